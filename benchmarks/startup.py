@@ -0,0 +1,78 @@
+"""
+Startup benchmark for filesorter.
+
+Measures the wall time of fresh interpreters that import filesorter, and of
+the command-line sort by extension and by media type on a small tree, and
+checks that none of the heavy optional modules are loaded on those paths.
+Both the script form (python filesorter.py, a small launcher that imports
+filesorter_core) and python -m filesorter are measured. Bytecode writing is enabled in the child processes so the cache is
+warm after the first run.
+
+Usage: python benchmarks/startup.py [--runs N]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(os.path.dirname(HERE), "filesorter.py")
+HEAVY_MODULES = ("cv2", "PIL", "numpy", "colorama", "sqlite3", "multiprocessing", "concurrent.futures")
+
+
+ENV = {key: value for key, value in os.environ.items() if key != "PYTHONDONTWRITEBYTECODE"}
+ENV["PYTHONPATH"] = os.path.dirname(SCRIPT)
+
+
+def time_command(command: list, runs: int) -> list:
+    """Return the wall times in milliseconds of running command runs times, after a warm-up run."""
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=ENV)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=ENV)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def loaded_heavy_modules(folder: str, criteria: str) -> list:
+    """Run a sort in a fresh interpreter and return the heavy modules it loaded."""
+    code = ("import sys, filesorter; filesorter.main(['sort', sys.argv[1], '--by', sys.argv[2]]); "
+            f"print('loaded:' + ','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", code, folder, criteria], check=True,
+                            capture_output=True, text=True, env=ENV)
+    loaded = result.stdout.rsplit("loaded:", 1)[1].strip()
+    return [name for name in loaded.split(",") if name]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20, help="runs per measurement (default: 20)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        for index in range(100):
+            ext = (".jpg", ".mp4", ".txt", ".mp3")[index % 4]
+            with open(os.path.join(folder, f"file{index}{ext}"), "wb") as f:
+                f.write(b"\0" * 64)
+        cases = [
+            ("python -c pass", [sys.executable, "-c", "pass"]),
+            ("import filesorter", [sys.executable, "-c", "import filesorter"]),
+            ("script sort extension", [sys.executable, SCRIPT, "sort", folder, "--by", "extension"]),
+            ("-m sort extension", [sys.executable, "-m", "filesorter", "sort", folder, "--by", "extension"]),
+            ("-m sort media_type", [sys.executable, "-m", "filesorter", "sort", folder, "--by", "media_type"]),
+        ]
+        print(f"{'case':<24}{'min ms':>10}{'median ms':>12}")
+        for name, command in cases:
+            times = time_command(command, args.runs)
+            print(f"{name:<24}{min(times):>10.1f}{statistics.median(times):>12.1f}")
+        for criteria in ("extension", "media_type"):
+            heavy = loaded_heavy_modules(folder, criteria)
+            print(f"heavy modules loaded by sort --by {criteria}: {', '.join(heavy) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
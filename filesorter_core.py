@@ -0,0 +1,4111 @@
+import os
+import argparse
+import shutil
+import sys
+import re
+import errno
+import io
+import json
+import queue
+import struct
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+from collections.abc import Sequence
+from itertools import repeat
+# cv2, PIL, colorama, sqlite3, multiprocessing, concurrent.futures and hashlib are
+# imported where they are first needed, so that commands which never probe,
+# cache or copy (e.g. sorting by extension) start quickly.
+
+IMAGE_EXTENSIONS = {
+    '.jpg', '.jpeg', '.jpe',
+    '.png',
+    '.gif',
+    '.bmp',
+    '.tiff', '.tif',
+    '.svg',
+    '.webp',
+    '.ico',
+    '.heic', '.heif',
+    '.avif',
+    '.raw', '.arw', '.cr2', '.nef', '.orf', '.dng', '.raf', '.rw2', '.pef', '.sr2',
+    '.jxr'  # JPEG XR
+}
+
+VIDEO_EXTENSIONS = {
+    '.mp4',
+    '.avi',
+    '.mkv',
+    '.mov',
+    '.wmv',
+    '.flv',
+    '.mpeg', '.mpg',
+    '.m4v',
+    '.3gp', '.3g2',
+    '.vob',
+    '.rm', '.rmvb',
+    '.m2ts', '.mts', '.ts',
+    '.webm',
+    '.divx',
+    '.xvid',
+    '.ogv'
+}
+
+AUDIO_EXTENSIONS = {
+    '.mp3',
+    '.wav',
+    '.aac',
+    '.flac',
+    '.ogg',
+    '.wma',
+    '.m4a',
+    '.opus',
+    '.aiff',
+    '.alac',
+    '.pcm',
+    '.amr',
+    '.ape',
+    '.mka',
+    '.ra',
+    '.wv',
+    '.mid', '.midi',
+    '.ac3'
+}
+
+MISCELLANEOUS_EXTENSIONS = {
+    # Documents
+    '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx',
+    '.odt', '.ods', '.odp', '.rtf', '.txt', '.tex',
+
+    # Archives / Compressed Files
+    '.zip', '.rar', '.7z', '.tar', '.gz', '.bz2', '.xz', '.iso', '.dmg',
+
+    # Executables / System Files
+    '.exe', '.msi', '.apk', '.bat', '.cmd', '.sh', '.bash', '.app', '.jar',
+
+    # Programming / Markup / Data Files
+    '.py', '.js', '.ts', '.html', '.htm', '.css', '.cpp', '.c', '.h', '.hpp',
+    '.java', '.rb', '.go', '.rs', '.php', '.pl', '.cs', '.swift', '.kt', '.m',
+    '.json', '.xml', '.yml', '.yaml', '.ini', '.cfg', '.conf',
+
+    # E-books
+    '.epub', '.mobi', '.azw', '.azw3',
+
+    # 3D Files
+    '.stl', '.obj', '.fbx', '.dae',
+
+    # Fonts
+    '.ttf', '.otf', '.woff', '.woff2',
+
+    # Others
+    '.log', '.csv', '.bak', '.db', '.sql', '.lnk', '.torrent'
+}
+
+
+# Multi-part extensions that name a single format; they are matched before the last suffix alone.
+COMPOUND_EXTENSIONS = {
+    '.tar.gz', '.tar.bz2', '.tar.xz', '.tar.zst', '.tar.lz', '.tar.lzma', '.tar.z'
+}
+_COMPOUND_SUFFIXES = {os.path.splitext(ext)[1] for ext in COMPOUND_EXTENSIONS}
+
+# Media types in code order; FileRecord stores the code rather than the name.
+MEDIA_TYPES = ("image", "video", "audio", "misc", "other")
+MEDIA_TYPE_CODES = {name: code for code, name in enumerate(MEDIA_TYPES)}
+OTHER_MEDIA_CODE = MEDIA_TYPE_CODES["other"]
+
+# Every known extension mapped to its media type code, so classifying a file is
+# one dictionary lookup. Earlier sets take precedence, as in the original chain of checks.
+MEDIA_CODE_BY_EXTENSION = {}
+for _media_type, _extensions in (("misc", COMPOUND_EXTENSIONS), ("misc", MISCELLANEOUS_EXTENSIONS),
+                                 ("audio", AUDIO_EXTENSIONS), ("video", VIDEO_EXTENSIONS),
+                                 ("image", IMAGE_EXTENSIONS)):
+    MEDIA_CODE_BY_EXTENSION.update(dict.fromkeys(_extensions, MEDIA_TYPE_CODES[_media_type]))
+del _media_type, _extensions
+
+
+def file_extension(file_path: str) -> str:
+    """Return the lower-case extension of a file, e.g. '.jpg' or the compound '.tar.gz' ('' if none)."""
+    stem, ext = os.path.splitext(file_path)
+    ext = ext.lower()
+    if ext in _COMPOUND_SUFFIXES:
+        compound = os.path.splitext(stem)[1].lower() + ext
+        if compound in COMPOUND_EXTENSIONS:
+            return compound
+    return ext
+
+
+def get_media_type(file_path: str) -> str:
+    """Determine the media type based on the file extension."""
+    return MEDIA_TYPES[MEDIA_CODE_BY_EXTENSION.get(file_extension(file_path), OTHER_MEDIA_CODE)]
+
+
+IMAGE_HEADER_BYTES = 32  # Enough to identify every format handled by read_image_size.
+
+
+def _jpeg_size(f, head: bytes):
+    """Walk the JPEG marker segments up to the first SOFn frame header."""
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b'\xff':
+            byte = f.read(1)
+        while byte == b'\xff':
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            continue  # Standalone markers carry no length.
+        if marker == 0xD9 or marker == 0xDA:
+            return None  # End of image or start of scan before any frame header.
+        length = struct.unpack('>H', f.read(2))[0]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack('>xHH', f.read(5))
+            return (width, height) if height else None
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def _png_size(f, head: bytes):
+    if head[12:16] != b'IHDR':
+        return None
+    return struct.unpack('>II', head[16:24])
+
+
+def _gif_size(f, head: bytes):
+    return struct.unpack('<HH', head[6:10])
+
+
+def _bmp_size(f, head: bytes):
+    header_size = struct.unpack('<I', head[14:18])[0]
+    if header_size == 12:  # BITMAPCOREHEADER
+        return struct.unpack('<HH', head[18:22])
+    width, height = struct.unpack('<ii', head[18:26])
+    return (width, abs(height))
+
+
+def _webp_size(f, head: bytes):
+    chunk = head[12:16]
+    f.seek(20)
+    data = f.read(10)
+    if chunk == b'VP8 ' and data[3:6] == b'\x9d\x01\x2a':
+        width, height = struct.unpack('<HH', data[6:10])
+        return (width & 0x3FFF, height & 0x3FFF)
+    if chunk == b'VP8L' and data[0] == 0x2F:
+        bits = int.from_bytes(data[1:5], 'little')
+        return ((bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+    if chunk == b'VP8X':
+        return (int.from_bytes(data[4:7], 'little') + 1, int.from_bytes(data[7:10], 'little') + 1)
+    return None
+
+
+def _tiff_size(f, head: bytes):
+    """Read ImageWidth and ImageLength from the first IFD."""
+    order = '<' if head[:2] == b'II' else '>'
+    f.seek(struct.unpack(order + 'I', head[4:8])[0])
+    count = struct.unpack(order + 'H', f.read(2))[0]
+    entries = f.read(12 * count)
+    size = {}
+    for offset in range(0, len(entries) - 11, 12):
+        tag, field_type = struct.unpack(order + 'HH', entries[offset:offset + 4])
+        if tag in (256, 257):
+            value_format = 'H' if field_type == 3 else 'I'
+            size[tag] = struct.unpack(order + value_format, entries[offset + 8:offset + 8 + struct.calcsize(value_format)])[0]
+    if 256 in size and 257 in size:
+        return (size[256], size[257])
+    return None
+
+
+def _ico_size(f, head: bytes):
+    """Return the largest image listed in the icon directory (as Pillow does)."""
+    count = struct.unpack('<H', head[4:6])[0]
+    f.seek(6)
+    entries = f.read(16 * count)
+    sizes = [(entries[i] or 256, entries[i + 1] or 256) for i in range(0, len(entries) - 15, 16)]
+    return max(sizes, key=lambda s: s[0] * s[1]) if sizes else None
+
+
+# (signature test on the first IMAGE_HEADER_BYTES bytes, size parser)
+IMAGE_HEADER_PARSERS = [
+    (lambda h: h[:3] == b'\xff\xd8\xff', _jpeg_size),
+    (lambda h: h[:8] == b'\x89PNG\r\n\x1a\n', _png_size),
+    (lambda h: h[:6] in (b'GIF87a', b'GIF89a'), _gif_size),
+    (lambda h: h[:2] == b'BM', _bmp_size),
+    (lambda h: h[:4] == b'RIFF' and h[8:12] == b'WEBP', _webp_size),
+    (lambda h: h[:4] in (b'II*\x00', b'MM\x00*'), _tiff_size),
+    (lambda h: h[:4] == b'\x00\x00\x01\x00', _ico_size),
+]
+
+
+class UnrecognizedFormat(Exception):
+    """Raised by read_image_size and read_video_size for formats without a header parser."""
+
+
+def read_image_size(file_path: str):
+    """
+    Return the (width, height) of an image by parsing only its header.
+    Returns None if the header is recognized but damaged, and raises
+    UnrecognizedFormat if no header parser matches the file.
+    """
+    with open(file_path, 'rb') as f:
+        head = f.read(IMAGE_HEADER_BYTES)
+        for matches, parser in IMAGE_HEADER_PARSERS:
+            if matches(head):
+                try:
+                    return parser(f, head)
+                except (struct.error, ValueError, IndexError):
+                    return None
+    raise UnrecognizedFormat(file_path)
+
+
+def get_image_resolution(file_path: str):
+    """
+    Return the (width, height) of an image file.
+    Common formats are read from their headers; Pillow is only imported and
+    used for formats the header parsers do not recognize.
+    """
+    try:
+        return read_image_size(file_path)
+    except UnrecognizedFormat:
+        pass
+    except OSError:
+        return None
+    try:
+        from PIL import Image
+        with Image.open(file_path) as img:
+            return img.size
+    except Exception:
+        return None
+
+
+def _iter_mp4_boxes(f, start: int, end: int):
+    """Yield (box type, payload start, payload end) for the ISO BMFF boxes in [start, end)."""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        payload = offset + 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            payload += 8
+        elif size == 0:
+            size = end - offset
+        if size < payload - offset:
+            return
+        yield box_type, payload, min(offset + size, end)
+        offset += size
+
+
+def _mp4_video_size(f, head: bytes):
+    """
+    Find the first video track in the moov box.
+    The coded size comes from the stsd visual sample entry; the tkhd display
+    size is used when the sample description cannot be read.
+    """
+    f.seek(0, os.SEEK_END)
+    file_end = f.tell()
+    moov = next((b for b in _iter_mp4_boxes(f, 0, file_end) if b[0] == b'moov'), None)
+    if moov is None:
+        return None
+    fallback = None
+    for box_type, start, end in list(_iter_mp4_boxes(f, moov[1], moov[2])):
+        if box_type != b'trak':
+            continue
+        children = {b[0]: b for b in _iter_mp4_boxes(f, start, end)}
+        tkhd = children.get(b'tkhd')
+        if tkhd and tkhd[2] - tkhd[1] >= 84:
+            f.seek(tkhd[2] - 8)
+            width, height = struct.unpack('>II', f.read(8))
+            if width >> 16 and height >> 16 and fallback is None:
+                fallback = (width >> 16, height >> 16)
+        mdia = children.get(b'mdia')
+        if mdia is None:
+            continue
+        mdia_children = {b[0]: b for b in _iter_mp4_boxes(f, mdia[1], mdia[2])}
+        hdlr = mdia_children.get(b'hdlr')
+        if hdlr is None:
+            continue
+        f.seek(hdlr[1] + 8)
+        if f.read(4) != b'vide':
+            continue
+        box = mdia_children.get(b'minf')
+        for name in (b'stbl', b'stsd'):
+            if box is None:
+                break
+            box = next((b for b in _iter_mp4_boxes(f, box[1], box[2]) if b[0] == name), None)
+        if box is not None:
+            # Full box header (8), entry header (8), reserved + data reference (8), pre_defined (16).
+            f.seek(box[1] + 40)
+            width, height = struct.unpack('>HH', f.read(4))
+            if width and height:
+                return (width, height)
+        if fallback:
+            return fallback
+    return fallback
+
+
+def _read_ebml_vint(f, keep_marker: bool):
+    """Read an EBML variable-length integer. Returns (value, is_unknown_size)."""
+    first = f.read(1)
+    if not first:
+        raise EOFError
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first[0] & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ValueError("invalid EBML length")
+    value = first[0] if keep_marker else first[0] & (mask - 1)
+    for byte in f.read(length - 1):
+        value = (value << 8) | byte
+    return value, not keep_marker and value == (1 << (7 * length)) - 1
+
+
+def _iter_ebml_elements(f, start: int, end: int):
+    """Yield (element id, data start, data end) for EBML elements in [start, end)."""
+    offset = start
+    while offset < end:
+        f.seek(offset)
+        try:
+            element_id, _ = _read_ebml_vint(f, keep_marker=True)
+            size, unknown = _read_ebml_vint(f, keep_marker=False)
+        except EOFError:
+            return
+        data = f.tell()
+        data_end = end if unknown else min(data + size, end)
+        yield element_id, data, data_end
+        if unknown:
+            return  # Only a master element of unknown size can follow; its children end the parent.
+        offset = data_end
+
+
+MKV_SEGMENT = 0x18538067
+MKV_TRACKS = 0x1654AE6B
+MKV_TRACK_ENTRY = 0xAE
+MKV_TRACK_TYPE = 0x83
+MKV_VIDEO = 0xE0
+MKV_PIXEL_WIDTH = 0xB0
+MKV_PIXEL_HEIGHT = 0xBA
+MKV_CLUSTER = 0x1F43B675
+
+
+def _matroska_video_size(f, head: bytes):
+    """Read PixelWidth/PixelHeight of the first video TrackEntry of a Matroska/WebM file."""
+    f.seek(0, os.SEEK_END)
+    file_end = f.tell()
+
+    def read_uint(start, end):
+        f.seek(start)
+        return int.from_bytes(f.read(end - start), 'big')
+
+    for element_id, start, end in _iter_ebml_elements(f, 0, file_end):
+        if element_id != MKV_SEGMENT:
+            continue
+        for child_id, child_start, child_end in _iter_ebml_elements(f, start, end):
+            if child_id == MKV_CLUSTER:
+                return None  # Track headers always precede the first cluster.
+            if child_id != MKV_TRACKS:
+                continue
+            for entry_id, entry_start, entry_end in list(_iter_ebml_elements(f, child_start, child_end)):
+                if entry_id != MKV_TRACK_ENTRY:
+                    continue
+                fields = {i: (s, e) for i, s, e in _iter_ebml_elements(f, entry_start, entry_end)}
+                if MKV_VIDEO not in fields:
+                    continue
+                if MKV_TRACK_TYPE in fields and read_uint(*fields[MKV_TRACK_TYPE]) != 1:
+                    continue
+                video = {i: (s, e) for i, s, e in _iter_ebml_elements(f, *fields[MKV_VIDEO])}
+                if MKV_PIXEL_WIDTH in video and MKV_PIXEL_HEIGHT in video:
+                    return (read_uint(*video[MKV_PIXEL_WIDTH]), read_uint(*video[MKV_PIXEL_HEIGHT]))
+            return None
+    return None
+
+
+AVI_HEADER_LIST_LIMIT = 1 << 20
+
+
+def _iter_riff_chunks(data: bytes, offset: int = 0):
+    """Yield (chunk id, chunk data) for the RIFF chunks in data, starting at offset."""
+    while offset + 8 <= len(data):
+        chunk_id, size = struct.unpack('<4sI', data[offset:offset + 8])
+        yield chunk_id, data[offset + 8:offset + 8 + size]
+        offset += 8 + size + (size & 1)
+
+
+def _avi_video_size(f, head: bytes):
+    """
+    Read the BITMAPINFOHEADER (strf) of the first video stream (strh 'vids') in the hdrl list,
+    falling back to the main AVI header (avih).
+    """
+    f.seek(12)
+    chunk_id, size = struct.unpack('<4sI', f.read(8))
+    if chunk_id != b'LIST' or size > AVI_HEADER_LIST_LIMIT:
+        return None
+    hdrl = f.read(size)
+    if hdrl[:4] != b'hdrl':
+        return None
+    fallback = None
+    for chunk_id, data in _iter_riff_chunks(hdrl, 4):
+        if chunk_id == b'avih' and len(data) >= 40:
+            width, height = struct.unpack('<II', data[32:40])
+            fallback = (width, height) if width and height else None
+        elif chunk_id == b'LIST' and data[:4] == b'strl':
+            stream = dict(_iter_riff_chunks(data, 4))
+            strh, strf = stream.get(b'strh', b''), stream.get(b'strf', b'')
+            if strh[:4] == b'vids' and len(strf) >= 12:
+                width, height = struct.unpack('<ii', strf[4:12])
+                if width and height:
+                    return (width, abs(height))
+    return fallback
+
+
+MPEG_STREAM_PROBE_BYTES = 1 << 20
+
+
+def _exp_golomb_reader(data: bytes):
+    """Return (read_bits, read_ue, read_se) closures over an RBSP byte string."""
+    position = [0]
+
+    def read_bits(count):
+        value = 0
+        for _ in range(count):
+            byte = data[position[0] >> 3]
+            value = (value << 1) | ((byte >> (7 - (position[0] & 7))) & 1)
+            position[0] += 1
+        return value
+
+    def read_ue():
+        zeros = 0
+        while read_bits(1) == 0:
+            zeros += 1
+            if zeros > 31:
+                raise ValueError("invalid Exp-Golomb code")
+        return (1 << zeros) - 1 + read_bits(zeros)
+
+    def read_se():
+        value = read_ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+    return read_bits, read_ue, read_se
+
+
+def _h264_sps_size(nal: bytes):
+    """Compute the cropped frame size from an H.264 sequence parameter set NAL unit."""
+    rbsp = nal[1:].replace(b'\x00\x00\x03', b'\x00\x00')
+    read_bits, read_ue, read_se = _exp_golomb_reader(rbsp)
+    profile_idc = read_bits(8)
+    read_bits(16)  # Constraint flags and level_idc.
+    read_ue()  # seq_parameter_set_id
+    chroma_format_idc = 1
+    if profile_idc in (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135):
+        chroma_format_idc = read_ue()
+        if chroma_format_idc == 3:
+            read_bits(1)  # separate_colour_plane_flag
+        read_ue()
+        read_ue()
+        read_bits(1)
+        if read_bits(1):  # seq_scaling_matrix_present_flag
+            for index in range(8 if chroma_format_idc != 3 else 12):
+                if read_bits(1):
+                    last_scale = next_scale = 8
+                    for _ in range(16 if index < 6 else 64):
+                        if next_scale:
+                            next_scale = (last_scale + read_se() + 256) % 256
+                        last_scale = next_scale or last_scale
+    read_ue()  # log2_max_frame_num_minus4
+    pic_order_cnt_type = read_ue()
+    if pic_order_cnt_type == 0:
+        read_ue()
+    elif pic_order_cnt_type == 1:
+        read_bits(1)
+        read_se()
+        read_se()
+        for _ in range(read_ue()):
+            read_se()
+    read_ue()  # max_num_ref_frames
+    read_bits(1)
+    width_in_mbs = read_ue() + 1
+    height_in_map_units = read_ue() + 1
+    frame_mbs_only = read_bits(1)
+    if not frame_mbs_only:
+        read_bits(1)
+    read_bits(1)
+    width = width_in_mbs * 16
+    height = (2 - frame_mbs_only) * height_in_map_units * 16
+    if read_bits(1):  # frame_cropping_flag
+        left, right, top, bottom = read_ue(), read_ue(), read_ue(), read_ue()
+        crop_x = 1 if chroma_format_idc in (0, 3) else 2
+        crop_y = (2 - frame_mbs_only) * (2 if chroma_format_idc == 1 else 1)
+        width -= (left + right) * crop_x
+        height -= (top + bottom) * crop_y
+    return (width, height)
+
+
+# MPEG-TS PMT stream types whose sequence headers _elementary_stream_size understands.
+TS_STREAM_CODECS = {0x01: "mpeg", 0x02: "mpeg", 0x1B: "h264"}
+
+
+def _elementary_stream_size(data: bytes, codec: str):
+    """Find an MPEG-1/2 sequence header ("mpeg") or an H.264 SPS ("h264") in elementary stream bytes."""
+    offset = data.find(b'\x00\x00\x01')
+    while 0 <= offset < len(data) - 4:
+        code = data[offset + 3]
+        if codec == "mpeg" and code == 0xB3 and offset + 7 <= len(data):
+            b0, b1, b2 = data[offset + 4:offset + 7]
+            width, height = (b0 << 4) | (b1 >> 4), ((b1 & 0x0F) << 8) | b2
+            if width and height:
+                return (width, height)
+        elif codec == "h264" and code & 0x9F == 0x07:  # NAL unit type 7, forbidden bit clear
+            end = data.find(b'\x00\x00\x01', offset + 4)
+            try:
+                width, height = _h264_sps_size(data[offset + 3:end if end != -1 else len(data)])
+                if 0 < width <= 16384 and 0 < height <= 16384:
+                    return (width, height)
+            except (IndexError, ValueError):
+                pass
+        offset = data.find(b'\x00\x00\x01', offset + 3)
+    return None
+
+
+def _ts_section(chunks: list):
+    """Return the first PSI section carried by a PID's payloads, or None."""
+    data = b''.join(chunks)
+    if not data:
+        return None
+    data = data[1 + data[0]:]  # Skip the pointer field.
+    if len(data) < 3:
+        return None
+    length = ((data[1] & 0x0F) << 8) | data[2]
+    return data[:3 + length]
+
+
+def _ts_video_streams(payloads: dict):
+    """Map the PIDs of supported video streams to their codec using the PAT and PMTs."""
+    pat = _ts_section(payloads.get(0, []))
+    if pat is None:
+        return {}
+    streams = {}
+    for offset in range(8, len(pat) - 4 - 3, 4):
+        program = (pat[offset] << 8) | pat[offset + 1]
+        if program == 0:
+            continue  # Network information table.
+        pmt = _ts_section(payloads.get(((pat[offset + 2] & 0x1F) << 8) | pat[offset + 3], []))
+        if pmt is None or pmt[0] != 0x02:
+            continue
+        offset_es = 12 + (((pmt[10] & 0x0F) << 8) | pmt[11])
+        while offset_es + 5 <= len(pmt) - 4:
+            stream_type = pmt[offset_es]
+            pid = ((pmt[offset_es + 1] & 0x1F) << 8) | pmt[offset_es + 2]
+            if stream_type in TS_STREAM_CODECS:
+                streams[pid] = TS_STREAM_CODECS[stream_type]
+            offset_es += 5 + (((pmt[offset_es + 3] & 0x0F) << 8) | pmt[offset_es + 4])
+    return streams
+
+
+def _mpeg_stream_video_size(f, head: bytes):
+    """
+    Probe an MPEG transport stream (188- or 192-byte packets) or program stream.
+    Transport packets are demultiplexed per PID, and only the video streams
+    declared in the PMT are searched, each with the parser for its codec.
+    """
+    f.seek(0)
+    data = f.read(MPEG_STREAM_PROBE_BYTES)
+    for packet_size, sync_offset in ((188, 0), (192, 4)):
+        if len(data) > packet_size + sync_offset and data[sync_offset] == 0x47 \
+                and data[packet_size + sync_offset] == 0x47:
+            break
+    else:
+        if not data.startswith(b'\x00\x00\x01'):
+            return None
+        return _elementary_stream_size(data, "mpeg")  # Program stream: the payload is not packetized.
+    payloads = {}
+    for offset in range(sync_offset, len(data) - 187, packet_size):
+        packet = data[offset:offset + 188]
+        if packet[0] != 0x47:
+            continue
+        pid = ((packet[1] & 0x1F) << 8) | packet[2]
+        adaptation = (packet[3] >> 4) & 0x3
+        start = 4
+        if adaptation in (2, 3):
+            start += 1 + packet[4]
+        if adaptation in (1, 3) and start < 188:
+            payloads.setdefault(pid, []).append(packet[start:])
+    for pid, codec in _ts_video_streams(payloads).items():
+        size = _elementary_stream_size(b''.join(payloads.get(pid, [])), codec)
+        if size:
+            return size
+    return None
+
+
+def _is_mpeg_stream(head: bytes) -> bool:
+    return (head[0] == 0x47 or head[4] == 0x47) or head[:4] in (b'\x00\x00\x01\xba', b'\x00\x00\x01\xb3')
+
+
+# (signature test on the first VIDEO_HEADER_BYTES bytes, size parser)
+VIDEO_HEADER_BYTES = 16
+VIDEO_HEADER_PARSERS = [
+    (lambda h: h[4:8] in (b'ftyp', b'moov', b'mdat', b'free', b'wide', b'skip'), _mp4_video_size),
+    (lambda h: h[:4] == b'\x1a\x45\xdf\xa3', _matroska_video_size),
+    (lambda h: h[:4] == b'RIFF' and h[8:12] == b'AVI ', _avi_video_size),
+    (_is_mpeg_stream, _mpeg_stream_video_size),
+]
+
+
+def read_video_size(file_path: str):
+    """
+    Return the (width, height) of a video by demultiplexing only its container headers.
+    Returns None if the container is recognized but holds no size this parser
+    understands, and raises UnrecognizedFormat if no container parser matches.
+    """
+    with open(file_path, 'rb') as f:
+        head = f.read(VIDEO_HEADER_BYTES)
+        if len(head) == VIDEO_HEADER_BYTES:
+            for matches, parser in VIDEO_HEADER_PARSERS:
+                if matches(head):
+                    try:
+                        return parser(f, head)
+                    except (struct.error, ValueError, IndexError, EOFError):
+                        return None
+    raise UnrecognizedFormat(file_path)
+
+
+def get_video_resolution(file_path: str):
+    """
+    Return the (width, height) of a video file.
+    The size is read from the container headers where possible; OpenCV is only
+    imported and a decoder started when the container probe finds nothing.
+    """
+    try:
+        size = read_video_size(file_path)
+        if size:
+            return size
+    except UnrecognizedFormat:
+        pass
+    except OSError:
+        return None
+    try:
+        import cv2
+        cap = cv2.VideoCapture(file_path)
+        if not cap.isOpened():
+            return None
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        cap.release()
+        return (width, height)
+    except Exception:
+        return None
+
+
+SNIFF_BYTES = 512  # Header read for content sniffing; the furthest signature is the tar magic at 257.
+
+# (offset, magic bytes, extension) checked in order by sniff_header; the first match wins.
+CONTENT_SIGNATURES = (
+    # Images
+    (0, b'\xff\xd8\xff', '.jpg'),
+    (0, b'\x89PNG\r\n\x1a\n', '.png'),
+    (0, b'GIF87a', '.gif'),
+    (0, b'GIF89a', '.gif'),
+    (0, b'II*\x00', '.tiff'),
+    (0, b'MM\x00*', '.tiff'),
+    (0, b'II\xbc\x01', '.jxr'),
+    (0, b'\x00\x00\x01\x00', '.ico'),
+    # Video
+    (0, b'\x1aE\xdf\xa3', '.mkv'),  # EBML; WebM is told apart by its DocType
+    (0, b'FLV\x01', '.flv'),
+    (0, b'\x00\x00\x01\xba', '.mpg'),
+    (0, b'0&\xb2u\x8ef\xcf\x11', '.wmv'),  # ASF header GUID
+    (0, b'.RMF', '.rm'),
+    # Audio
+    (0, b'ID3', '.mp3'),
+    (0, b'fLaC', '.flac'),
+    (0, b'OggS', '.ogg'),
+    (0, b'MThd', '.mid'),
+    (0, b'#!AMR', '.amr'),
+    (0, b'MAC ', '.ape'),
+    (0, b'wvpk', '.wv'),
+    # Archives
+    (0, b'PK\x03\x04', '.zip'),
+    (0, b'Rar!\x1a\x07', '.rar'),
+    (0, b"7z\xbc\xaf'\x1c", '.7z'),
+    (0, b'\x1f\x8b', '.gz'),
+    (0, b'BZh', '.bz2'),
+    (0, b'\xfd7zXZ\x00', '.xz'),
+    (257, b'ustar', '.tar'),
+    # Documents and others
+    (0, b'%PDF-', '.pdf'),
+    (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', '.doc'),  # OLE compound file
+    (0, b'{\\rtf', '.rtf'),
+    (0, b'SQLite format 3\x00', '.db'),
+)
+
+RIFF_FORMATS = {b'WAVE': '.wav', b'AVI ': '.avi', b'WEBP': '.webp'}
+FTYP_BRANDS = {
+    b'heic': '.heic', b'heix': '.heic', b'hevc': '.heic', b'heim': '.heic', b'heis': '.heic',
+    b'mif1': '.heif', b'msf1': '.heif', b'avif': '.avif', b'avis': '.avif',
+    b'qt  ': '.mov', b'M4A ': '.m4a', b'M4B ': '.m4a', b'M4V ': '.m4v',
+}
+
+# Extensions that legitimately hold the content identified as the key, e.g.
+# Office documents are zip files and most camera raw formats are TIFF-based.
+CONTENT_ALIASES = {
+    '.jpg': {'.jpeg', '.jpe'},
+    '.tiff': {'.tif', '.raw', '.arw', '.cr2', '.nef', '.orf', '.dng', '.pef', '.sr2'},
+    '.heic': {'.heif'},
+    '.heif': {'.heic', '.avif'},  # A 'mif1' major brand is also used by AVIF images.
+    '.ico': {'.cur'},
+    '.mp4': {'.m4v', '.m4a', '.mov', '.3gp', '.3g2', '.heic', '.heif', '.avif', '.f4v'},
+    '.mov': {'.mp4', '.m4v'},
+    '.m4a': {'.mp4', '.aac', '.alac', '.m4b'},
+    '.m4v': {'.mp4'},
+    '.3gp': {'.3g2', '.mp4'},
+    '.mkv': {'.mka', '.webm', '.mk3d'},
+    '.webm': {'.mkv', '.mka'},
+    '.mpg': {'.mpeg', '.vob'},
+    '.ts': {'.mts', '.m2ts'},
+    '.m2ts': {'.mts', '.ts'},
+    '.wmv': {'.wma', '.asf'},
+    '.rm': {'.rmvb', '.ra'},
+    '.ogg': {'.ogv', '.oga', '.opus', '.spx'},
+    '.mp3': {'.mp2', '.mpa'},
+    '.mid': {'.midi'},
+    '.aiff': {'.aif', '.aifc'},
+    '.zip': {'.docx', '.xlsx', '.pptx', '.odt', '.ods', '.odp', '.jar', '.apk', '.epub', '.xpi', '.cbz', '.whl'},
+    '.gz': {'.tgz', '.tar.gz'},
+    '.bz2': {'.tbz2', '.tar.bz2'},
+    '.xz': {'.txz', '.tar.xz'},
+    '.doc': {'.xls', '.ppt', '.msi', '.msg'},
+    '.db': {'.sqlite', '.sqlite3'},
+    '.exe': {'.dll', '.sys', '.scr', '.com'},
+}
+
+
+# MPEG audio bitrates in kbit/s by bitrate index 1-14, per (MPEG-1, layer) and (MPEG-2/2.5, layer).
+MPEG_AUDIO_BITRATES = {
+    (1, 1): (32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Sample rates by sample rate index 0-2, per version bits (0: MPEG-2.5, 2: MPEG-2, 3: MPEG-1).
+MPEG_AUDIO_SAMPLE_RATES = {0: (11025, 12000, 8000), 2: (22050, 24000, 16000), 3: (44100, 48000, 32000)}
+
+
+def _mpeg_audio_frame_length(head: bytes) -> int:
+    """Length in bytes of the MPEG audio frame whose header starts head, or 0 if the header is invalid."""
+    version_bits, layer = (head[1] >> 3) & 3, 4 - ((head[1] >> 1) & 3)
+    bitrate_index, rate_index, padding = head[2] >> 4, (head[2] >> 2) & 3, (head[2] >> 1) & 1
+    # Reserved version, layer or sample rate; free-format (0) or "bad" (15) bitrate.
+    if version_bits == 1 or layer == 4 or rate_index == 3 or bitrate_index in (0, 15):
+        return 0
+    bitrate = MPEG_AUDIO_BITRATES[(1 if version_bits == 3 else 2, layer)][bitrate_index - 1] * 1000
+    sample_rate = MPEG_AUDIO_SAMPLE_RATES[version_bits][rate_index]
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4
+    if layer == 3 and version_bits != 3:
+        return 72 * bitrate // sample_rate + padding
+    return 144 * bitrate // sample_rate + padding
+
+
+def _adts_frame_length(head: bytes) -> int:
+    """Length in bytes of the ADTS (AAC) frame whose header starts head, or 0 if it is invalid."""
+    length = ((head[3] & 3) << 11) | (head[4] << 3) | (head[5] >> 5)
+    return length if length >= 7 else 0
+
+
+def sniff_header(head: bytes) -> str:
+    """Identify a file from its first SNIFF_BYTES bytes; returns an extension such as '.png', or ''."""
+    for offset, magic, ext in CONTENT_SIGNATURES:
+        if head.startswith(magic, offset):
+            if ext == '.mkv' and b'webm' in head[:64]:
+                return '.webm'
+            return ext
+    if len(head) >= 12:
+        if head[:4] == b'RIFF' and head[8:12] in RIFF_FORMATS:
+            return RIFF_FORMATS[head[8:12]]
+        if head[:4] == b'FORM' and head[8:12] in (b'AIFF', b'AIFC'):
+            return '.aiff'
+        if head[4:8] == b'ftyp':
+            brand = head[8:12]
+            if brand[:3] in (b'3gp', b'3g2'):
+                return '.3gp'
+            return FTYP_BRANDS.get(brand, '.mp4')
+    if len(head) >= 64 and head[:2] == b'MZ':
+        # DOS header: only a Windows executable if e_lfanew points at a PE header.
+        pe_offset = struct.unpack_from('<I', head, 60)[0]
+        if head[pe_offset:pe_offset + 4] == b'PE\x00\x00':
+            return '.exe'
+    if len(head) >= 18 and head[:2] == b'BM' and struct.unpack_from('<I', head, 14)[0] in (12, 40, 56, 64, 108, 124):
+        return '.bmp'
+    if len(head) > 376 and head[0] == head[188] == head[376] == 0x47:
+        return '.ts'
+    if len(head) > 388 and head[4] == head[196] == head[388] == 0x47:
+        return '.m2ts'
+    # An MPEG audio or ADTS frame sync, but not the UTF-16LE byte-order mark FF FE, which also looks like one.
+    if len(head) >= 6 and head[0] == 0xff and head[1] & 0xe0 == 0xe0 and head[1] != 0xfe:
+        if head[1] & 0xf6 == 0xf0:
+            ext, length, same_stream = '.aac', _adts_frame_length(head), 0xf6
+        else:
+            ext, length, same_stream = '.mp3', _mpeg_audio_frame_length(head), 0xfe
+        # The next frame header (same sync, version and layer) must follow the first one,
+        # unless the first frame runs past the sniffed bytes.
+        if length and (length + 2 > len(head)
+                       or head[length] == 0xff and head[length + 1] & same_stream == head[1] & same_stream):
+            return ext
+    return ''
+
+
+def sniff_file(file_path: str) -> str:
+    """Read the header of a file and identify it with sniff_header ('' if unrecognized or unreadable)."""
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+    except OSError:
+        return ''
+    try:
+        return sniff_header(os.read(fd, SNIFF_BYTES))
+    except OSError:
+        return ''
+    finally:
+        os.close(fd)
+
+
+def content_matches_extension(content_ext: str, ext: str) -> bool:
+    """Whether a file named with ext can legitimately have the content identified as content_ext."""
+    return ext == content_ext or ext in CONTENT_ALIASES.get(content_ext, ())
+
+
+EXIF_HEADER_BYTES = 64 * 1024  # Only this much of a file is parsed to find its capture time.
+EXIF_IFD_POINTER = 0x8769      # IFD0 tag pointing to the Exif IFD.
+EXIF_DATETIME_TAGS = (0x9003, 0x9004)  # DateTimeOriginal, then DateTimeDigitized.
+# Extensions of the formats read_exif_datetime understands: JPEG, TIFF and TIFF-based camera raw, HEIF.
+EXIF_EXTENSIONS = {'.jpg', '.jpeg', '.jpe', '.tif', '.tiff', '.heic', '.heif',
+                   '.raw', '.arw', '.cr2', '.nef', '.orf', '.dng', '.pef', '.sr2'}
+_EXIF_DATETIME = re.compile(rb'(\d{4}):(\d\d):(\d\d) \d\d:\d\d:\d\d')
+
+
+def _tiff_exif_datetime(data: bytes, start: int) -> str:
+    """
+    Return DateTimeOriginal (or else DateTimeDigitized) from the TIFF structure
+    at data[start:], whose offsets are relative to start; '' if it has none.
+    """
+    order = '<' if data[start:start + 2] == b'II' else '>'
+
+    def ifd_entries(offset: int) -> dict:
+        """Map each tag of the IFD at offset to (field type, value count, position of the value field)."""
+        position = start + offset
+        count = struct.unpack_from(order + 'H', data, position)[0]
+        entries = {}
+        for entry in range(position + 2, position + 2 + 12 * count, 12):
+            tag, field_type, value_count = struct.unpack_from(order + 'HHI', data, entry)
+            entries[tag] = (field_type, value_count, entry + 8)
+        return entries
+
+    pointer = ifd_entries(struct.unpack_from(order + 'I', data, start + 4)[0]).get(EXIF_IFD_POINTER)
+    if pointer is None:
+        return ''
+    exif = ifd_entries(struct.unpack_from(order + 'I', data, pointer[2])[0])
+    for tag in EXIF_DATETIME_TAGS:
+        field = exif.get(tag)
+        if field is None or field[0] != 2 or field[1] < 20:  # ASCII 'YYYY:MM:DD HH:MM:SS\0'
+            continue
+        value_start = start + struct.unpack_from(order + 'I', data, field[2])[0]
+        value = data[value_start:value_start + 19]
+        match = _EXIF_DATETIME.fullmatch(value)
+        # Cameras without a set clock write '0000:00:00 00:00:00' or blanks.
+        if match and int(match[1]) and 1 <= int(match[2]) <= 12 and 1 <= int(match[3]) <= 31:
+            return value.decode('ascii')
+    return ''
+
+
+def _jpeg_exif_start(data: bytes):
+    """Position in data of the TIFF header inside the Exif APP1 segment of a JPEG, or None."""
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:
+            position += 1  # Fill byte.
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            position += 2  # Standalone markers carry no length.
+            continue
+        if marker == 0xD9 or marker == 0xDA:
+            return None  # End of image or start of scan: no Exif segment.
+        if marker == 0xE1 and data[position + 4:position + 10] == b'Exif\x00\x00':
+            return position + 10
+        position += 2 + struct.unpack_from('>H', data, position + 2)[0]
+    return None
+
+
+def _heif_exif_extent(data: bytes):
+    """
+    Return the (file offset, length) of the Exif item of a HEIF image, from
+    the iinf and iloc boxes of its meta box in data, or None.
+    """
+    buffer = io.BytesIO(data)
+    meta = next(((start, end) for box_type, start, end in _iter_mp4_boxes(buffer, 0, len(data))
+                 if box_type == b'meta'), None)
+    if meta is None:
+        return None
+    # meta, iinf, infe and iloc are full boxes: the payload starts with a version byte and 3 flag bytes.
+    children = {box_type: (start, end) for box_type, start, end in _iter_mp4_boxes(buffer, meta[0] + 4, meta[1])}
+    if b'iinf' not in children or b'iloc' not in children:
+        return None
+    start, end = children[b'iinf']
+    exif_item = None
+    for box_type, item_start, item_end in _iter_mp4_boxes(buffer, start + (6 if data[start] == 0 else 8), end):
+        if box_type == b'infe' and data[item_start] in (2, 3):
+            item_format = '>H2x4s' if data[item_start] == 2 else '>I2x4s'
+            item_id, item_type = struct.unpack_from(item_format, data, item_start + 4)
+            if item_type == b'Exif':
+                exif_item = item_id
+                break
+    if exif_item is None:
+        return None
+
+    start, end = children[b'iloc']
+    version = data[start]
+    offset_size, length_size = data[start + 4] >> 4, data[start + 4] & 15
+    base_offset_size, index_size = data[start + 5] >> 4, data[start + 5] & 15 if version in (1, 2) else 0
+    position = start + 6
+
+    def read(size: int) -> int:
+        nonlocal position
+        if position + size > end:
+            raise ValueError("truncated iloc box")
+        value = int.from_bytes(data[position:position + size], 'big')
+        position += size
+        return value
+
+    id_size = 2 if version < 2 else 4
+    for _ in range(read(id_size)):
+        item_id = read(id_size)
+        construction_method = read(2) & 15 if version in (1, 2) else 0
+        read(2)  # data_reference_index
+        base_offset = read(base_offset_size)
+        extents = []
+        for _ in range(read(2)):
+            if index_size:
+                read(index_size)
+            extents.append((base_offset + read(offset_size), read(length_size)))
+        if item_id == exif_item:
+            # Only items stored as a single extent in the file itself are supported.
+            return extents[0] if construction_method == 0 and len(extents) == 1 else None
+    return None
+
+
+def read_exif_datetime(file_path: str) -> str:
+    """
+    Return the capture time recorded in the EXIF data of a JPEG, TIFF (or
+    TIFF-based camera raw) or HEIF/HEIC image, as 'YYYY:MM:DD HH:MM:SS', or ''
+    if the file has none or cannot be read.
+    Only the first EXIF_HEADER_BYTES of the file are parsed, and nothing is
+    decoded; a HEIF file whose Exif item lies beyond them costs one more read.
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            data = f.read(EXIF_HEADER_BYTES)
+            if data[:3] == b'\xff\xd8\xff':
+                start = _jpeg_exif_start(data)
+            elif data[:4] in (b'II*\x00', b'MM\x00*'):
+                start = 0
+            elif data[4:8] == b'ftyp' and FTYP_BRANDS.get(data[8:12]) in ('.heic', '.heif'):
+                extent = _heif_exif_extent(data)
+                if extent is None:
+                    return ''
+                offset, length = extent
+                if offset + length > len(data):
+                    f.seek(offset)
+                    data = f.read(min(length, EXIF_HEADER_BYTES))
+                    offset = 0
+                # The Exif item starts with the offset of the TIFF header past its own 4 bytes.
+                start = offset + 4 + struct.unpack_from('>I', data, offset)[0]
+            else:
+                return ''
+            return '' if start is None else _tiff_exif_datetime(data, start)
+    except (OSError, struct.error, ValueError, IndexError):
+        return ''
+
+
+_colorama = None
+
+
+def _colors():
+    """Return colorama's (Fore, Style), importing and initializing colorama on first use."""
+    global _colorama
+    if _colorama is None:
+        from colorama import init, Fore, Style
+        init(autoreset=True)  # Initialize colorama for colored output
+        _colorama = (Fore, Style)
+    return _colorama
+
+
+def print_success(message: str):
+    """Print a message in green to indicate success."""
+    Fore, Style = _colors()
+    print(Fore.GREEN + message + Style.RESET_ALL)
+
+
+def print_error(message: str, stream=None):
+    """
+    Print a message in red to indicate an error, on stream (default: standard output).
+    The colour is left out when the stream is not a terminal, e.g. a piped log.
+    """
+    stream = stream or sys.stdout
+    if hasattr(stream, "isatty") and stream.isatty():
+        Fore, Style = _colors()
+        message = Fore.RED + message + Style.RESET_ALL
+    print(message, file=stream)
+
+
+class ProgressReporter:
+    """
+    Collects per-file events and reports throughput instead of printing every file.
+    A progress line (files/s, MB/s and, when the totals are known, the ETA) is
+    written at most once per interval seconds; on a terminal it is redrawn in
+    place. Per-file messages go to log_path, if given, through a large write
+    buffer, and are printed in one batched write per interval when verbose is
+    set. Errors and skipped files are always printed immediately.
+    """
+
+    def __init__(self, total_files: int = None, total_bytes: int = None, interval: float = 1.0,
+                 log_path: str = None, verbose: bool = False, stream=None):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.verbose = verbose
+        self._stream = stream  # None means whatever sys.stdout is at the time of writing.
+        self.is_tty = hasattr(self.stream, "isatty") and self.stream.isatty()
+        self.log = open(log_path, "a", encoding="utf-8", errors="surrogateescape",
+                        buffering=1 << 20) if log_path else None
+        self.files = 0
+        self.bytes = 0
+        self.errors = 0
+        self.skipped = 0
+        self.started = time.monotonic()
+        self._last_report = self.started
+        self._pending = []  # Verbose messages not printed yet.
+        self._line_open = False  # A progress line is on screen without a newline.
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def stream(self):
+        return self._stream or sys.stdout
+
+    def success(self, message: str, nbytes: int = 0):
+        """Record a successfully processed file."""
+        self.files += 1
+        self.bytes += nbytes
+        if self.log is not None:
+            self.log.write(message + "\n")
+        if self.verbose:
+            self._pending.append(message)
+        now = time.monotonic()
+        if now - self._last_report >= self.interval:
+            self._report(now)
+
+    def failure(self, message: str):
+        """Record and immediately print a failure."""
+        self.errors += 1
+        if self.log is not None:
+            self.log.write("ERROR: " + message + "\n")
+        self._end_line()
+        if self.is_tty:
+            Fore, Style = _colors()
+            message = Fore.RED + message + Style.RESET_ALL
+        self.stream.write(message + "\n")
+
+    def skip(self, message: str = None):
+        """Record a file left alone on purpose; the message, if any, is printed immediately."""
+        self.skipped += 1
+        if message is None:
+            return
+        if self.log is not None:
+            self.log.write("SKIPPED: " + message + "\n")
+        self._end_line()
+        self.stream.write(message + "\n")
+
+    def progress_line(self, now: float = None) -> str:
+        elapsed = max((now or time.monotonic()) - self.started, 1e-9)
+        files_rate = self.files / elapsed
+        done = self.files + self.skipped
+        line = f"{done}"
+        if self.total_files:
+            line += f"/{self.total_files}"
+        line += f" files, {files_rate:.0f} files/s, {self.bytes / elapsed / 1e6:.1f} MB/s"
+        if self.total_bytes and self.bytes:
+            remaining = (self.total_bytes - self.bytes) / (self.bytes / elapsed)
+        elif self.total_files and self.files:
+            remaining = (self.total_files - done) / files_rate
+        else:
+            remaining = None
+        if remaining is not None:
+            minutes, seconds = divmod(int(max(remaining, 0)), 60)
+            line += f", ETA {minutes // 60}:{minutes % 60:02d}:{seconds:02d}"
+        if self.skipped:
+            line += f", {self.skipped} skipped"
+        if self.errors:
+            line += f", {self.errors} failed"
+        return line
+
+    def _end_line(self):
+        if self._line_open:
+            self.stream.write("\n")
+            self._line_open = False
+
+    def _report(self, now: float):
+        self._last_report = now
+        if self._pending:
+            self._end_line()
+            self.stream.write("\n".join(self._pending) + "\n")
+            self._pending = []
+        if self.is_tty:
+            self.stream.write("\r" + self.progress_line(now) + "\033[K")
+            self._line_open = True
+        else:
+            self.stream.write(self.progress_line(now) + "\n")
+        self.stream.flush()
+
+    def close(self):
+        """Print the final progress line and close the log file."""
+        self._report(time.monotonic())
+        self._end_line()
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+
+def clean_folder_name(name: str) -> str:
+    """
+    Clean up a folder name by removing invalid characters.
+    If the name starts with a dot, remove it.
+    Replace any characters that are not alphanumeric, underscore, or hyphen with an underscore.
+    """
+    if name.startswith('.'):
+        name = name[1:]
+    return re.sub(r'[^A-Za-z0-9_\-]', '_', name)
+
+
+def _sparse_field(column: str):
+    """FileRecord attribute backed by a sparse FileTable column; None (unknown) is not stored."""
+    def get(self):
+        return getattr(self.table, column).get(self.index)
+
+    def set(self, value):
+        if value is None:
+            getattr(self.table, column).pop(self.index, None)
+        else:
+            getattr(self.table, column)[self.index] = value
+    return property(get, set)
+
+
+class FileRecord:
+    """
+    Stat data captured for a single file during the scan: a view of one row of a FileTable.
+    Later steps read these cached values instead of touching the file again.
+    The extension and media type are classified once, when the row is added,
+    so sorting and moving never look at the name again; the full path is
+    derived on access. A FileRecord constructed directly gets a table of its own.
+    """
+    __slots__ = ("table", "index")
+
+    def __init__(self, path: str, size: int, mtime: float, inode: int, dev: int, is_symlink: bool = False,
+                 resolution=None, directory: str = None, content_ext: str = None, image_hash=None):
+        if directory is None:
+            directory, name = os.path.split(path)
+        else:
+            name = path  # The caller already split the path.
+        self.table = FileTable()
+        self.index = self.table.append(name, directory, size, mtime, inode, dev, is_symlink, resolution,
+                                       content_ext, image_hash)
+
+    @classmethod
+    def _row(cls, table: "FileTable", index: int) -> "FileRecord":
+        record = cls.__new__(cls)
+        record.table = table
+        record.index = index
+        return record
+
+    directory = property(lambda self: self.table.directories[self.index])
+    name = property(lambda self: self.table.names[self.index])
+    ext = property(lambda self: self.table.exts[self.index])
+    media_code = property(lambda self: self.table.media_codes[self.index])
+    size = property(lambda self: self.table.sizes[self.index])
+    mtime = property(lambda self: self.table.mtimes[self.index])
+    inode = property(lambda self: self.table.inodes[self.index])
+    dev = property(lambda self: self.table.devs[self.index])
+    is_symlink = property(lambda self: bool(self.table.symlinks[self.index]))
+    # (width, height) once probed, () if the file could not be probed, None if not probed yet.
+    resolution = _sparse_field("resolutions")
+    # Extension identified from the file's content by sniff_file, '' if unrecognized, None if not sniffed yet.
+    content_ext = _sparse_field("content_exts")
+    # (dhash, phash) from image_hashes, () if the image could not be decoded, None if not hashed yet.
+    image_hash = _sparse_field("image_hashes")
+    # EXIF capture time from read_exif_datetime, '' if the file has none, None if not read yet.
+    capture_time = _sparse_field("capture_times")
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.table.directories[self.index], self.table.names[self.index])
+
+    @property
+    def media_type(self) -> str:
+        return MEDIA_TYPES[self.table.media_codes[self.index]]
+
+    @classmethod
+    def from_dir_entry(cls, entry, directory: str = None):
+        """
+        Build a record from an os.DirEntry, using a single stat call.
+        directory is the path that was listed, if known (it saves splitting entry.path).
+        Broken symlinks fall back to the stat data of the link itself.
+        """
+        table = FileTable()
+        table.append_dir_entry(entry, directory)
+        return table[0]
+
+    def relocate(self, new_path: str):
+        """Point the record at a new path after a move or rename; stat data is unchanged."""
+        self.table.relocate(self.index, new_path)
+
+
+class FileTable(Sequence):
+    """
+    FileRecords stored column by column, since a large scan holds millions of them.
+    Stat data is kept in typed arrays, and directories and extensions are
+    interned strings shared by many rows, so a row costs little more than its
+    basename. The resolution, content type, image hash and capture time are
+    known for only some files and are kept in dictionaries keyed by row.
+    Indexing or iterating yields FileRecord views of the rows.
+    """
+    DENSE_COLUMNS = ("directories", "names", "exts", "media_codes", "sizes", "mtimes", "inodes", "devs", "symlinks")
+    SPARSE_COLUMNS = ("resolutions", "content_exts", "image_hashes", "capture_times")
+    __slots__ = DENSE_COLUMNS + SPARSE_COLUMNS
+
+    def __init__(self):
+        self.directories = []
+        self.names = []
+        self.exts = []
+        self.media_codes = array("B")
+        self.sizes = array("q")
+        self.mtimes = array("d")
+        self.inodes = array("Q")
+        self.devs = array("Q")
+        self.symlinks = array("B")
+        self.resolutions = {}
+        self.content_exts = {}
+        self.image_hashes = {}
+        self.capture_times = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self.names)
+        if not 0 <= index < len(self.names):
+            raise IndexError("FileTable index out of range")
+        return FileRecord._row(self, index)
+
+    def __iter__(self):
+        return map(FileRecord._row, repeat(self), range(len(self.names)))
+
+    def append(self, name: str, directory: str, size: int, mtime: float, inode: int, dev: int,
+               is_symlink: bool = False, resolution=None, content_ext: str = None, image_hash=None,
+               capture_time: str = None) -> int:
+        """Add a row for the file name in directory; returns its index."""
+        index = len(self.names)
+        self.directories.append(sys.intern(directory))
+        self.names.append(name)
+        ext, media_code = self._classify(name)
+        self.exts.append(ext)
+        self.media_codes.append(media_code)
+        self.sizes.append(size)
+        self.mtimes.append(mtime)
+        self.inodes.append(inode)
+        self.devs.append(dev)
+        self.symlinks.append(is_symlink)
+        if resolution is not None or content_ext is not None or image_hash is not None or capture_time is not None:
+            for column, value in zip(self.SPARSE_COLUMNS, (resolution, content_ext, image_hash, capture_time)):
+                if value is not None:
+                    getattr(self, column)[index] = value
+        return index
+
+    def append_dir_entry(self, entry, directory: str = None) -> int:
+        """
+        Add a row for an os.DirEntry, using a single stat call; see FileRecord.from_dir_entry.
+        Returns its index.
+        """
+        try:
+            st = entry.stat()
+        except OSError:
+            st = entry.stat(follow_symlinks=False)
+        if directory is None:
+            directory = os.path.dirname(entry.path)
+        return self.append(entry.name, directory, st.st_size, st.st_mtime, st.st_ino, st.st_dev, entry.is_symlink())
+
+    def extend(self, records):
+        """Copy the given FileRecords (rows of any table), or a whole FileTable, to the end of this one."""
+        if isinstance(records, FileTable):
+            offset = len(self.names)
+            for column in self.DENSE_COLUMNS:
+                getattr(self, column).extend(getattr(records, column))
+            for column in self.SPARSE_COLUMNS:
+                getattr(self, column).update((offset + row, value) for row, value in getattr(records, column).items())
+            return
+        for record in records:
+            source, row = record.table, record.index
+            index = len(self.names)
+            self.directories.append(source.directories[row])
+            self.names.append(source.names[row])
+            self.exts.append(source.exts[row])
+            self.media_codes.append(source.media_codes[row])
+            self.sizes.append(source.sizes[row])
+            self.mtimes.append(source.mtimes[row])
+            self.inodes.append(source.inodes[row])
+            self.devs.append(source.devs[row])
+            self.symlinks.append(source.symlinks[row])
+            if source.resolutions or source.content_exts or source.image_hashes or source.capture_times:
+                for column in self.SPARSE_COLUMNS:
+                    value = getattr(source, column).get(row)
+                    if value is not None:
+                        getattr(self, column)[index] = value
+
+    def relocate(self, index: int, new_path: str):
+        """Point row index at a new path after a move or rename; see FileRecord.relocate."""
+        directory, name = os.path.split(new_path)
+        self.directories[index] = sys.intern(directory)
+        self.names[index] = name
+        self.exts[index], self.media_codes[index] = self._classify(name)
+
+    @staticmethod
+    def _classify(name: str) -> tuple:
+        """The extension (interned, so equal extensions share one string) and media type code of name."""
+        ext = sys.intern(file_extension(name))
+        return ext, MEDIA_CODE_BY_EXTENSION.get(ext, OTHER_MEDIA_CODE)
+
+
+class RecordPaths(Sequence):
+    """
+    Read-only sequence of the paths of FileRecords, optionally selected by an
+    array of indices. FileOrganizer hands out its files and groups this way,
+    so paths are built on access instead of being stored next to the records.
+    """
+    __slots__ = ("records", "indices")
+
+    def __init__(self, records: list, indices: array = None):
+        self.records = records
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.records if self.indices is None else self.indices)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if self.indices is None:
+            return self.records[position].path
+        return self.records[self.indices[position]].path
+
+    def __iter__(self):
+        if self.indices is None:
+            return (record.path for record in self.records)
+        records = self.records
+        return (records[index].path for index in self.indices)
+
+    def __repr__(self):
+        return f"RecordPaths({list(self)!r})"
+
+
+def _scan_one_directory(dirpath: str):
+    """
+    List a single directory.
+    Returns a tuple (records, subdirs) with a FileTable row for every file and
+    the paths of subdirectories to descend into. Symlinked directories are not
+    followed and an unreadable directory yields nothing, as with os.walk.
+    """
+    records = FileTable()
+    subdirs = []
+    try:
+        with os.scandir(dirpath) as it:
+            entries = list(it)
+    except OSError:
+        return records, subdirs
+    for entry in entries:
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if is_dir:
+            if not entry.is_symlink():
+                subdirs.append(entry.path)
+            continue
+        try:
+            records.append_dir_entry(entry, dirpath)
+        except OSError:
+            continue
+    return records, subdirs
+
+
+def scan_directory(root_folder: str, tables: bool = False):
+    """
+    Walk root_folder with os.scandir and yield a FileRecord for every file.
+    Files are yielded in the same order as os.walk (top-down, listing order).
+    With tables, each directory's FileTable is yielded instead of its records.
+    """
+    stack = [root_folder]
+    while stack:
+        records, subdirs = _scan_one_directory(stack.pop())
+        if tables:
+            yield records
+        else:
+            yield from records
+        stack.extend(reversed(subdirs))
+
+
+def scan_directory_parallel(root_folder: str, workers: int = 8, ordered: bool = True, tables: bool = False):
+    """
+    Walk root_folder using a pool of worker threads and yield a FileRecord for every file.
+    Each worker keeps its own deque of directories: it takes the most recently
+    found directory from its own deque and, when that runs dry, steals the
+    oldest (shallowest) directory from another worker. Every directory is tagged
+    with its position in the tree so the files are yielded in exactly the same
+    order as scan_directory, regardless of which worker listed them.
+    With ordered=False, files are yielded as soon as their directory has been
+    listed (through a bounded queue), so the walk never holds the whole tree.
+    With tables, each directory's FileTable is yielded instead of its records.
+    """
+    workers = max(1, workers)
+    deques = [deque() for _ in range(workers)]
+    deques[0].append(((), root_folder))
+    results = {}
+    pending = [1]  # Directories queued or being listed.
+    condition = threading.Condition()
+    batches = queue.Queue(maxsize=workers * 4)
+    stopped = threading.Event()
+
+    def take(me: int):
+        own = deques[me]
+        if own:
+            return own.pop()
+        for offset in range(1, workers):
+            victim = deques[(me + offset) % workers]
+            if victim:
+                return victim.popleft()
+        return None
+
+    def run(me: int):
+        while True:
+            with condition:
+                task = take(me)
+                while task is None:
+                    if pending[0] == 0:
+                        return
+                    condition.wait()
+                    task = take(me)
+            key, dirpath = task
+            records, subdirs = [], []
+            try:
+                records, subdirs = _scan_one_directory(dirpath)
+                if not ordered and records:
+                    while not stopped.is_set():
+                        try:
+                            batches.put(records, timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+            finally:
+                with condition:
+                    if ordered:
+                        results[key] = records
+                    if stopped.is_set():
+                        subdirs = []
+                    for index in range(len(subdirs) - 1, -1, -1):
+                        deques[me].append((key + (index,), subdirs[index]))
+                    pending[0] += len(subdirs) - 1
+                    if subdirs or pending[0] == 0:
+                        condition.notify_all()
+
+    threads = [threading.Thread(target=run, args=(me,), daemon=True) for me in range(workers)]
+    for thread in threads:
+        thread.start()
+    if not ordered:
+        def finish():
+            for thread in threads:
+                thread.join()
+            batches.put(None)
+        threading.Thread(target=finish, daemon=True).start()
+        try:
+            while True:
+                records = batches.get()
+                if records is None:
+                    return
+                if tables:
+                    yield records
+                else:
+                    yield from records
+        finally:
+            # The consumer stopped early: let the workers drain and exit.
+            stopped.set()
+    for thread in threads:
+        thread.join()
+    # Sorting the position tuples reproduces the top-down walk order.
+    for key in sorted(results):
+        if tables:
+            yield results[key]
+        else:
+            yield from results[key]
+
+
+class NameIndex:
+    """
+    In-memory index of the file names taken in each target folder.
+    A folder is listed the first time it is used and then kept up to date as
+    names are reserved, so finding a free name never touches the filesystem.
+    For every (folder, base, ext) the next counter to try is remembered, which
+    makes handing out the next free 'base_N.ext' constant time.
+    """
+
+    def __init__(self):
+        self._names = {}     # Folder -> set of taken names.
+        self._counters = {}  # (folder, base, ext) -> next counter to try.
+
+    def _folder_names(self, folder: str) -> set:
+        names = self._names.get(folder)
+        if names is None:
+            try:
+                names = set(os.listdir(folder))
+            except OSError:
+                names = set()
+            self._names[folder] = names
+        return names
+
+    def reserve(self, folder: str, filename: str) -> str:
+        """Return filename or its first free 'base_N.ext' variant in folder, and mark it taken."""
+        names = self._folder_names(folder)
+        if filename not in names:
+            names.add(filename)
+            return filename
+        base, ext = os.path.splitext(filename)
+        key = (folder, base, ext)
+        counter = self._counters.get(key, 1)
+        while f"{base}_{counter}{ext}" in names:
+            counter += 1
+        self._counters[key] = counter + 1
+        name = f"{base}_{counter}{ext}"
+        names.add(name)
+        return name
+
+    def add(self, folder: str, name: str):
+        """Mark a name as taken (e.g. a file that appeared behind our back)."""
+        self._folder_names(folder).add(name)
+
+    def release(self, folder: str, name: str):
+        """Mark a name as free again."""
+        self._folder_names(folder).discard(name)
+
+
+class DirectoryCache:
+    """
+    Remembers the directories already ensured to exist during a run, so each one
+    is created (or found to exist) with at most one system call.
+    """
+
+    def __init__(self):
+        self._ensured = set()
+
+    def ensure(self, folder: str):
+        """Make sure folder exists, creating it and any missing parents."""
+        if folder in self._ensured:
+            return
+        parent = os.path.dirname(folder)
+        if parent in self._ensured:
+            try:
+                os.mkdir(folder)
+            except FileExistsError:
+                if not os.path.isdir(folder):
+                    raise
+        else:
+            os.makedirs(folder, exist_ok=True)
+        while folder not in self._ensured and folder != parent:
+            self._ensured.add(folder)
+            folder, parent = parent, os.path.dirname(parent)
+
+    def ensure_all(self, folders) -> dict:
+        """
+        Create a whole set of folders in one pass, parents before children.
+        Returns a dictionary mapping the folders that could not be created to their error.
+        """
+        failed = {}
+        for folder in sorted(set(folders)):
+            try:
+                self.ensure(folder)
+            except OSError as e:
+                failed[folder] = e
+        return failed
+
+    def forget(self, folder: str):
+        """Drop a folder (e.g. one that was removed) from the cache."""
+        self._ensured.discard(folder)
+
+
+def claim_destination(target_folder: str, filename: str, name_index: NameIndex, dest_path: str = None) -> str:
+    """
+    Atomically claim a free destination path in target_folder.
+    The claim is an empty placeholder created with O_EXCL, so a concurrent
+    writer can never be overwritten: if the name (dest_path, or the next free
+    name from the index) turns out to exist, the next free name is tried.
+    The caller moves the file over the placeholder. Returns the claimed path.
+    """
+    if dest_path is None:
+        dest_path = os.path.join(target_folder, name_index.reserve(target_folder, filename))
+    while True:
+        try:
+            os.close(os.open(dest_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return dest_path
+        except FileExistsError:
+            name_index.add(target_folder, os.path.basename(dest_path))
+            dest_path = os.path.join(target_folder, name_index.reserve(target_folder, filename))
+
+
+COPY_CHUNK_SIZE = 1 << 24  # Bytes per copy_file_range/sendfile call.
+COPY_BUFFER_SIZE = 1 << 20  # Buffer size for the plain read/write fallback.
+
+
+# errno values meaning "this kernel copy call is not supported for these files".
+_KERNEL_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.ENOTSUP,
+                            errno.EOPNOTSUPP, errno.EBADF, errno.ENOTSOCK}
+
+
+def _kernel_copy(in_fd: int, out_fd: int) -> int:
+    """
+    Copy from in_fd to out_fd inside the kernel, from offset 0.
+    Tries os.copy_file_range, then os.sendfile. Returns the number of bytes
+    copied, which is 0 if neither call is supported for these files.
+    """
+    for name in ('copy_file_range', 'sendfile'):
+        kernel_copy = getattr(os, name, None)
+        if kernel_copy is None:
+            continue
+        copied = 0
+        try:
+            while True:
+                if name == 'sendfile':
+                    sent = os.sendfile(out_fd, in_fd, copied, COPY_CHUNK_SIZE)
+                else:
+                    sent = os.copy_file_range(in_fd, out_fd, COPY_CHUNK_SIZE, copied, copied)
+                if sent == 0:
+                    return copied
+                copied += sent
+        except OSError as e:
+            if copied or e.errno not in _KERNEL_COPY_UNSUPPORTED:
+                raise
+    return 0
+
+
+def copy_file_contents(src: str, dest: str):
+    """
+    Copy the contents and metadata of src to dest (which is created or replaced).
+    The data is copied inside the kernel with os.copy_file_range or os.sendfile
+    where the platform supports it, and with large buffers otherwise. The copy
+    is written under a temporary name next to dest and renamed over it once
+    complete, so dest is never left partly written.
+    """
+    def create(temp: str):
+        with open(src, 'rb') as fsrc, open(temp, 'xb') as fdest:
+            copied = _kernel_copy(fsrc.fileno(), fdest.fileno())
+            if copied < os.fstat(fsrc.fileno()).st_size:
+                # Unsupported, or a filesystem that stops short: finish with plain reads.
+                fsrc.seek(copied)
+                fdest.seek(copied)
+                shutil.copyfileobj(fsrc, fdest, COPY_BUFFER_SIZE)
+        shutil.copystat(src, temp)
+
+    _create_over(dest, create)
+
+
+# How run() places a file at its destination:
+#   move     - rename (same device) or copy and remove the source
+#   hardlink - hard link to the source (same device only)
+#   reflink  - copy-on-write clone of the source (FICLONE, e.g. btrfs or XFS)
+#   symlink  - symbolic link to the source's absolute path
+#   copy     - full copy
+# Every mode except move keeps the source, and falls back to a copy when the
+# link or clone cannot be made.
+PLACEMENT_MODES = ("move", "hardlink", "reflink", "symlink", "copy")
+
+FICLONE = 0x40049409  # Linux ioctl: share all extents of one file with another.
+
+
+def _temp_path(dest: str) -> str:
+    """Temporary name under which a file is created before being renamed to dest."""
+    return dest + '.filesorter-tmp'
+
+
+def _remove_if_exists(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _is_complete_copy(src: str, dest: str) -> bool:
+    """
+    Whether dest is a finished copy of src: a link with the same target, or a
+    regular file with the size and modification time (which copies keep) of src.
+    """
+    if os.path.islink(src):
+        return os.path.islink(dest) and os.readlink(dest) == os.readlink(src)
+    if os.path.islink(dest) or not os.path.isfile(dest):
+        return False
+    src_stat, dest_stat = os.stat(src), os.stat(dest)
+    return dest_stat.st_size == src_stat.st_size and dest_stat.st_mtime_ns == src_stat.st_mtime_ns
+
+
+def _create_over(dest: str, create):
+    """Create a new file with create(temp_path) and atomically put it in place of dest."""
+    temp = _temp_path(dest)
+    try:
+        try:
+            create(temp)
+        except FileExistsError:
+            os.unlink(temp)  # Left over from an interrupted run.
+            create(temp)
+        os.replace(temp, dest)
+    except BaseException:
+        try:
+            os.unlink(temp)
+        except OSError:
+            pass
+        raise
+
+
+def reflink_file(src: str, dest: str):
+    """Make dest a copy-on-write clone of src. Raises OSError where cloning is unsupported."""
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.ENOTSUP, "reflinks are not supported on this platform")
+
+    def create(temp: str):
+        with open(src, 'rb') as fsrc, open(temp, 'xb') as fdest:
+            fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, temp)
+
+    _create_over(dest, create)
+
+
+class MoveEngine:
+    """
+    Moves files, renaming in place when possible and copying across devices.
+    A move whose source and target folder are on the same device is a single
+    os.replace. Cross-device moves are copied (see copy_file_contents) on a
+    pool of copy_workers threads, with at most max_in_flight files queued or
+    being copied at a time, and the source is removed once its copy is done.
+    run() can also place files by linking, cloning or copying them instead
+    (see PLACEMENT_MODES).
+    """
+
+    def __init__(self, copy_workers: int = 4, max_in_flight: int = None):
+        self.copy_workers = max(1, copy_workers)
+        self.max_in_flight = max_in_flight or self.copy_workers * 2
+        self._folder_devs = {}  # Target folder -> st_dev, stat'ed once per folder.
+
+    def folder_device(self, folder: str):
+        """Return the device of a target folder (cached), or None if it cannot be stat'ed."""
+        if folder not in self._folder_devs:
+            try:
+                self._folder_devs[folder] = os.stat(folder).st_dev
+            except OSError:
+                return None
+        return self._folder_devs[folder]
+
+    def planned_folder_device(self, folder: str):
+        """
+        Return the device a folder will be on once created: that of its nearest
+        existing ancestor. Nothing is created or cached for missing folders.
+        """
+        while True:
+            dev = self.folder_device(folder)
+            parent = os.path.dirname(folder)
+            if dev is not None or parent == folder:
+                return dev
+            folder = parent
+
+    @staticmethod
+    def copy_and_remove(src: str, dest: str):
+        """Move src to dest across devices: copy it over dest, then remove the source."""
+        if os.path.islink(src):
+            target = os.readlink(src)
+            _create_over(dest, lambda temp: os.symlink(target, temp))
+        else:
+            copy_file_contents(src, dest)
+        os.unlink(src)
+
+    def _try_rename(self, src: str, dest: str, src_dev) -> bool:
+        """Rename src over dest if both are on the same device; False if a copy is needed."""
+        dest_dev = self.folder_device(os.path.dirname(dest))
+        if src_dev is not None and dest_dev is not None and src_dev != dest_dev:
+            return False
+        try:
+            os.replace(src, dest)
+            return True
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                return False
+            raise
+
+    def _try_fast_placement(self, src: str, dest: str, src_dev, mode: str) -> bool:
+        """
+        Place src at dest without copying data (rename, link or clone).
+        Returns False if the mode needs, or has to fall back to, a full copy.
+        """
+        if mode == "move":
+            return self._try_rename(src, dest, src_dev)
+        if mode == "copy":
+            return False
+        dest_dev = self.folder_device(os.path.dirname(dest))
+        if mode in ("hardlink", "reflink") and src_dev is not None and dest_dev is not None \
+                and src_dev != dest_dev:
+            return False
+        try:
+            if mode == "hardlink":
+                _create_over(dest, lambda temp: os.link(src, temp, follow_symlinks=False))
+            elif mode == "symlink":
+                _create_over(dest, lambda temp: os.symlink(os.path.abspath(src), temp))
+            else:
+                reflink_file(src, dest)
+        except OSError:
+            return False
+        return True
+
+    def _copy_placement(self, src: str, dest: str, mode: str):
+        """Place src at dest by copying it (and removing the source when moving)."""
+        if mode == "move":
+            self.copy_and_remove(src, dest)
+        else:
+            copy_file_contents(src, dest)
+
+    def move(self, src: str, dest: str, src_dev: int = None):
+        """Move a single file to dest (which may be a placeholder to replace)."""
+        if not self._try_rename(src, dest, src_dev):
+            self.copy_and_remove(src, dest)
+
+    def run(self, jobs, mode: str = "move"):
+        """
+        Carry out the placements in jobs, an iterable of (key, src, dest, src_dev),
+        using one of PLACEMENT_MODES. Yields (key, dest, error) for every job as
+        it finishes, with error None on success; renames and links complete in
+        order, copies as their workers finish.
+        """
+        if mode not in PLACEMENT_MODES:
+            raise ValueError(f"Unknown placement mode '{mode}'.")
+        semaphore = threading.BoundedSemaphore(self.max_in_flight)
+        done = queue.Queue()
+        in_flight = 0
+
+        def copy(key, src, dest):
+            try:
+                self._copy_placement(src, dest, mode)
+                done.put((key, dest, None))
+            except Exception as e:
+                done.put((key, dest, e))
+            finally:
+                semaphore.release()
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=self.copy_workers) as pool:
+            for key, src, dest, src_dev in jobs:
+                try:
+                    placed = self._try_fast_placement(src, dest, src_dev, mode)
+                except Exception as e:
+                    yield key, dest, e
+                    continue
+                if placed:
+                    yield key, dest, None
+                else:
+                    semaphore.acquire()
+                    in_flight += 1
+                    pool.submit(copy, key, src, dest)
+                while not done.empty():
+                    in_flight -= 1
+                    yield done.get()
+            while in_flight:
+                in_flight -= 1
+                yield done.get()
+
+
+def move_file_to_folder(file_path: str, target_folder: str, name_index: NameIndex = None,
+                        dir_cache: DirectoryCache = None) -> str:
+    """
+    Move a file to the target folder.
+    If a file with the same name exists, append a counter to the filename.
+    Pass a shared NameIndex and DirectoryCache to avoid relisting and
+    re-checking the folder on every call.
+    Returns the new file path.
+    """
+    if name_index is None:
+        name_index = NameIndex()
+    if dir_cache is None:
+        dir_cache = DirectoryCache()
+    dir_cache.ensure(target_folder)
+    dest_path = claim_destination(target_folder, os.path.basename(file_path), name_index)
+    try:
+        MoveEngine().move(file_path, dest_path)
+    except BaseException:
+        os.unlink(dest_path)
+        name_index.release(target_folder, os.path.basename(dest_path))
+        raise
+    return dest_path
+
+
+def _signed64(value: int) -> int:
+    """Map an unsigned 64-bit hash to the signed range SQLite integers can hold."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _image_hash_columns(image_hash) -> tuple:
+    """Catalog columns (hashed, dhash, phash) for a FileRecord.image_hash value."""
+    if image_hash is None:
+        return 0, None, None
+    if not image_hash:
+        return 1, None, None
+    return 1, _signed64(image_hash[0]), _signed64(image_hash[1])
+
+
+def _image_hash_from_columns(hashed, dhash, phash):
+    """Inverse of _image_hash_columns."""
+    if not hashed:
+        return None
+    if dhash is None:
+        return ()
+    return dhash & ((1 << 64) - 1), phash & ((1 << 64) - 1)
+
+
+class ScanCatalog:
+    """
+    Persistent SQLite catalog of scanned directories and files.
+    Stores each file's stat data, media type and resolution, plus every
+    directory's mtime and subdirectories, so that later scans can skip
+    directories that have not changed (see scan_directory_incremental).
+    """
+
+    # Directories modified this close to the scan are not trusted on the next run:
+    # a file added within the same mtime tick would otherwise go unnoticed.
+    RACY_WINDOW_NS = 2_000_000_000
+    COMMIT_INTERVAL = 500  # Directories written between commits.
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        import sqlite3
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS directories (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER,
+                subdirs TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                directory TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                inode INTEGER NOT NULL,
+                dev INTEGER NOT NULL,
+                is_symlink INTEGER NOT NULL,
+                media_type TEXT NOT NULL,
+                probed INTEGER NOT NULL DEFAULT 0,
+                width INTEGER,
+                height INTEGER,
+                content_ext TEXT,
+                hashed INTEGER NOT NULL DEFAULT 0,
+                dhash INTEGER,
+                phash INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS files_directory ON files (directory, position);
+            CREATE INDEX IF NOT EXISTS files_identity ON files (dev, inode, size, mtime);
+        """)
+        # Catalogs created by older versions lack the columns added since.
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(files)")}
+        for column, definition in (("content_ext", "TEXT"), ("hashed", "INTEGER NOT NULL DEFAULT 0"),
+                                   ("dhash", "INTEGER"), ("phash", "INTEGER")):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE files ADD COLUMN {column} {definition}")
+        self._pending_writes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """Commit outstanding changes and close the database."""
+        self.conn.commit()
+        self.conn.close()
+
+    def _maybe_commit(self):
+        self._pending_writes += 1
+        if self._pending_writes >= self.COMMIT_INTERVAL:
+            self.conn.commit()
+            self._pending_writes = 0
+
+    @staticmethod
+    def _append_row(records: FileTable, row):
+        path, size, mtime, inode, dev, is_symlink, probed, width, height, content_ext, hashed, dhash, phash = row
+        resolution = None
+        if probed:
+            resolution = (width, height) if width is not None else ()
+        directory, name = os.path.split(path)
+        records.append(name, directory, size, mtime, inode, dev, bool(is_symlink), resolution, content_ext,
+                       _image_hash_from_columns(hashed, dhash, phash))
+
+    def lookup_directory(self, dirpath: str):
+        """Return (mtime_ns, subdirs) for a cataloged directory, or None."""
+        row = self.conn.execute(
+            "SELECT mtime_ns, subdirs FROM directories WHERE path = ?", (dirpath,)).fetchone()
+        if row is None:
+            return None
+        return row[0], [s for s in row[1].split("\0") if s]
+
+    def directory_files(self, dirpath: str) -> FileTable:
+        """Return the cataloged files of a directory as a FileTable, in listing order."""
+        rows = self.conn.execute(
+            "SELECT path, size, mtime, inode, dev, is_symlink, probed, width, height, content_ext, "
+            "hashed, dhash, phash FROM files WHERE directory = ? ORDER BY position", (dirpath,))
+        records = FileTable()
+        for row in rows:
+            self._append_row(records, row)
+        return records
+
+    def _known_details(self, record: FileRecord):
+        """
+        Find the stored resolution, content type and image hash of an unchanged
+        file, even if it was moved or renamed.
+        Returns (resolution, content_ext, image_hash), None where unknown.
+        """
+        row = self.conn.execute(
+            "SELECT probed, width, height, content_ext, hashed, dhash, phash FROM files "
+            "WHERE path = ? AND size = ? AND mtime = ? AND inode = ?",
+            (record.path, record.size, record.mtime, record.inode)).fetchone()
+        if row is None:
+            row = self.conn.execute(
+                "SELECT probed, width, height, content_ext, hashed, dhash, phash FROM files "
+                "WHERE dev = ? AND inode = ? AND size = ? AND mtime = ?",
+                (record.dev, record.inode, record.size, record.mtime)).fetchone()
+        if row is None:
+            return None, None, None
+        probed, width, height, content_ext, hashed, dhash, phash = row
+        resolution = None
+        if probed:
+            resolution = (width, height) if width is not None else ()
+        return resolution, content_ext, _image_hash_from_columns(hashed, dhash, phash)
+
+    def update_directory(self, dirpath: str, mtime_ns, records: list, subdirs: list, scan_started_ns: int):
+        """
+        Replace the catalog entries of a freshly listed directory.
+        Unchanged files keep their stored resolution, content type and image hash;
+        subdirectories that disappeared are removed together with everything below them.
+        """
+        for record in records:
+            if record.resolution is None or record.content_ext is None or record.image_hash is None:
+                resolution, content_ext, image_hash = self._known_details(record)
+                if record.resolution is None:
+                    record.resolution = resolution
+                if record.content_ext is None:
+                    record.content_ext = content_ext
+                if record.image_hash is None:
+                    record.image_hash = image_hash
+        previous = self.lookup_directory(dirpath)
+        if previous is not None:
+            for gone in set(previous[1]) - set(subdirs):
+                self.forget_tree(gone)
+        if mtime_ns is not None and scan_started_ns - mtime_ns < self.RACY_WINDOW_NS:
+            mtime_ns = None
+        self.conn.execute("DELETE FROM files WHERE directory = ?", (dirpath,))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO files (path, directory, position, size, mtime, inode, dev, is_symlink, "
+            "media_type, probed, width, height, content_ext, hashed, dhash, phash) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(r.path, dirpath, position, r.size, r.mtime, r.inode, r.dev, int(r.is_symlink), r.media_type,
+              int(r.resolution is not None),
+              r.resolution[0] if r.resolution else None,
+              r.resolution[1] if r.resolution else None,
+              r.content_ext) + _image_hash_columns(r.image_hash)
+             for position, r in enumerate(records)])
+        self.conn.execute(
+            "INSERT OR REPLACE INTO directories (path, mtime_ns, subdirs) VALUES (?, ?, ?)",
+            (dirpath, mtime_ns, "\0".join(subdirs)))
+        self._maybe_commit()
+
+    def forget_tree(self, dirpath: str):
+        """Remove a directory and everything below it from the catalog."""
+        # Every path below dirpath sorts between "dirpath/" and the next possible prefix.
+        prefix = dirpath.rstrip(os.sep) + os.sep
+        upper = prefix[:-1] + chr(ord(os.sep) + 1)
+        for table, column in (("files", "directory"), ("directories", "path")):
+            self.conn.execute(f"DELETE FROM {table} WHERE {column} = ?", (dirpath,))
+            self.conn.execute(f"DELETE FROM {table} WHERE {column} >= ? AND {column} < ?", (prefix, upper))
+        self._maybe_commit()
+
+    def store_resolutions(self, records):
+        """Persist the probed resolutions of the given records."""
+        self.conn.executemany(
+            "UPDATE files SET probed = 1, width = ?, height = ? WHERE path = ?",
+            [(r.resolution[0] if r.resolution else None,
+              r.resolution[1] if r.resolution else None,
+              r.path)
+             for r in records if r.resolution is not None])
+        self.conn.commit()
+
+    def store_image_hashes(self, records):
+        """Persist the computed image hashes of the given records."""
+        self.conn.executemany(
+            "UPDATE files SET hashed = ?, dhash = ?, phash = ? WHERE path = ?",
+            [_image_hash_columns(r.image_hash) + (r.path,) for r in records if r.image_hash is not None])
+        self.conn.commit()
+
+    def store_contents(self, records):
+        """Persist the sniffed content types of the given records."""
+        self.conn.executemany(
+            "UPDATE files SET content_ext = ? WHERE path = ?",
+            [(r.content_ext, r.path) for r in records if r.content_ext is not None])
+        self.conn.commit()
+
+
+class ResolutionCache:
+    """
+    Persistent SQLite cache of probed resolutions keyed on file identity.
+    Entries are keyed on (device, inode, size, mtime), so a file that is moved
+    or renamed keeps its entry while any modification invalidates it. A file
+    that could not be probed is stored too, so it is not retried either.
+    The cache keeps at most max_entries entries, evicting the least recently used.
+    """
+
+    def __init__(self, db_path: str, max_entries: int = 1_000_000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        import sqlite3
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS resolutions (
+                dev INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                width INTEGER,
+                height INTEGER,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (dev, inode, size, mtime)
+            );
+            CREATE INDEX IF NOT EXISTS resolutions_last_used ON resolutions (last_used);
+        """)
+        self._used = []  # Keys hit since the last flush; their last_used is bumped in one batch.
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @staticmethod
+    def _key(record: FileRecord):
+        return (record.dev, record.inode, record.size, record.mtime)
+
+    def fill(self, records: list) -> list:
+        """
+        Set the resolution of every record found in the cache.
+        Returns the records that were not cached and still need probing.
+        """
+        misses = []
+        for record in records:
+            row = self.conn.execute(
+                "SELECT width, height FROM resolutions WHERE dev = ? AND inode = ? AND size = ? AND mtime = ?",
+                self._key(record)).fetchone()
+            if row is None:
+                misses.append(record)
+            else:
+                record.resolution = (row[0], row[1]) if row[0] is not None else ()
+                self._used.append(self._key(record))
+        return misses
+
+    def store(self, records):
+        """Cache the probed resolutions of the given records."""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO resolutions (dev, inode, size, mtime, width, height, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [self._key(r) + (r.resolution[0] if r.resolution else None,
+                             r.resolution[1] if r.resolution else None, now)
+             for r in records if r.resolution is not None])
+        self.flush()
+
+    def flush(self):
+        """Record cache hits and evict the least recently used entries beyond max_entries."""
+        if self._used:
+            now = time.time()
+            self.conn.executemany(
+                "UPDATE resolutions SET last_used = ? WHERE dev = ? AND inode = ? AND size = ? AND mtime = ?",
+                [(now,) + key for key in self._used])
+            self._used = []
+        count = self.conn.execute("SELECT COUNT(*) FROM resolutions").fetchone()[0]
+        if count > self.max_entries:
+            self.conn.execute(
+                "DELETE FROM resolutions WHERE rowid IN "
+                "(SELECT rowid FROM resolutions ORDER BY last_used LIMIT ?)", (count - self.max_entries,))
+        self.conn.commit()
+
+    def close(self):
+        """Flush pending updates and close the database."""
+        self.flush()
+        self.conn.close()
+
+
+def scan_directory_incremental(root_folder: str, catalog: ScanCatalog, tables: bool = False):
+    """
+    Walk root_folder like scan_directory, but reuse the catalog for unchanged directories.
+    A directory whose mtime matches the catalog is not listed at all: its files
+    and subdirectories come straight from the catalog (note that, as with any
+    mtime-based scheme, a file rewritten in place without being re-created is
+    not noticed). Changed directories are listed and written back to the catalog.
+    With tables, each directory's FileTable is yielded instead of its records.
+    """
+    scan_started_ns = time.time_ns()
+    stack = [root_folder]
+    while stack:
+        dirpath = stack.pop()
+        try:
+            mtime_ns = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            catalog.forget_tree(dirpath)
+            continue
+        cached = catalog.lookup_directory(dirpath)
+        if cached is not None and cached[0] == mtime_ns:
+            records = catalog.directory_files(dirpath)
+            subdirs = cached[1]
+        else:
+            records, subdirs = _scan_one_directory(dirpath)
+            catalog.update_directory(dirpath, mtime_ns, records, subdirs, scan_started_ns)
+        if tables:
+            yield records
+        else:
+            yield from records
+        stack.extend(reversed(subdirs))
+
+
+def extension_key(record: FileRecord) -> str:
+    """Group key for sorting by extension."""
+    return record.ext or "no_extension"
+
+
+def media_type_key(record: FileRecord) -> str:
+    """Group key for sorting by media type."""
+    return record.media_type
+
+
+def classified_extension(record: FileRecord) -> str:
+    """
+    Extension of a file, corrected by its sniffed content: the content type is
+    used when the name has no extension or one that cannot hold that content.
+    """
+    content_ext = record.content_ext
+    if not content_ext or content_matches_extension(content_ext, record.ext):
+        return record.ext
+    return content_ext
+
+
+def content_extension_key(record: FileRecord) -> str:
+    """Group key for sorting by extension, corrected by the sniffed content."""
+    return classified_extension(record) or "no_extension"
+
+
+def content_media_type_key(record: FileRecord) -> str:
+    """Group key for sorting by media type, corrected by the sniffed content."""
+    return MEDIA_TYPES[MEDIA_CODE_BY_EXTENSION.get(classified_extension(record), OTHER_MEDIA_CODE)]
+
+
+DATE_GRANULARITIES = {"year": 4, "month": 7, "day": 10}  # Length of the 'YYYY-MM-DD' prefix kept.
+
+
+def capture_date(record: FileRecord) -> str:
+    """
+    Date a file was captured, as 'YYYY-MM-DD': its EXIF capture time if one
+    was read, else its modification time from the scan; '' if neither is usable.
+    """
+    if record.capture_time:
+        return record.capture_time[:10].replace(":", "-")
+    try:
+        return time.strftime("%Y-%m-%d", time.localtime(record.mtime))
+    except (OverflowError, OSError, ValueError):
+        return ""
+
+
+def _map_in_threads(function, items: list, workers: int, batch_size: int = 1) -> list:
+    """
+    Return [function(item) for item in items], computed on a pool of threads.
+    Each task handles a whole batch of items, so the pool overhead is paid once
+    per batch rather than once per item.
+    """
+    if workers <= 1 or len(items) <= batch_size:
+        return [function(item) for item in items]
+
+    def run_batch(batch):
+        return [function(item) for item in batch]
+
+    from concurrent.futures import ThreadPoolExecutor
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch_results in pool.map(run_batch, (items[i:i + batch_size] for i in range(0, len(items), batch_size))):
+            results.extend(batch_results)
+    return results
+
+
+def sniff_files(records: list, workers: int = 8, batch_size: int = 256):
+    """Sniff the content of the given records on a pool of threads, setting their content_ext."""
+    for record, content_ext in zip(records, _map_in_threads(lambda r: sniff_file(r.path), records, workers,
+                                                            batch_size)):
+        record.content_ext = content_ext
+
+
+DUPLICATE_EDGE_BYTES = 64 * 1024  # Bytes hashed at each end of a file by partial_hash.
+HASH_BUFFER_SIZE = 1024 * 1024    # Read size of full_hash.
+
+
+def _new_hash():
+    import hashlib
+    return hashlib.blake2b(digest_size=16)
+
+
+def partial_hash(file_path: str, size: int, edge: int = DUPLICATE_EDGE_BYTES):
+    """
+    BLAKE2b digest of the first and last edge bytes of a file of the given size
+    (of the whole file, if it is no larger than that). None if it cannot be read.
+    """
+    digest = _new_hash()
+    try:
+        with open(file_path, "rb", buffering=0) as f:
+            if size <= 2 * edge:
+                digest.update(f.read(2 * edge))
+            else:
+                digest.update(f.read(edge))
+                f.seek(size - edge)
+                digest.update(f.read(edge))
+    except OSError:
+        return None
+    return digest.digest()
+
+
+def full_hash(file_path: str, size: int = None):
+    """BLAKE2b digest of a whole file, read in large chunks; None if it cannot be read."""
+    digest = _new_hash()
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    try:
+        with open(file_path, "rb", buffering=0) as f:
+            while True:
+                length = f.readinto(buffer)
+                if not length:
+                    break
+                digest.update(view[:length])
+    except OSError:
+        return None
+    return digest.digest()
+
+
+def duplicate_sets(records: list, workers: int = 8, edge: int = DUPLICATE_EDGE_BYTES) -> list:
+    """
+    Find the sets of byte-identical files among records, in stages so that only
+    real candidates are read:
+      1. files are bucketed by size (from the scan, no I/O);
+      2. files sharing a size are split by partial_hash of their first and last edge bytes;
+      3. files that still collide, and are larger than the two edges, are split by full_hash.
+    Hard links to one inode are hashed once and always end up together.
+    Hashing runs on workers threads (BLAKE2b releases the GIL on large buffers).
+    Returns lists of indices into records, each in scan order, ordered by their first file.
+    """
+    by_size = {}
+    for index, record in enumerate(records):
+        by_size.setdefault(record.size, []).append(index)
+    # A candidate is a list of "links": each link lists the indices of the files sharing one inode.
+    candidates = []
+    settled = []
+    for size, indices in by_size.items():
+        if len(indices) < 2:
+            continue
+        if size == 0:
+            settled.append([indices])  # Empty files are all identical.
+            continue
+        links = {}
+        for index in indices:
+            record = records[index]
+            links.setdefault((record.dev, record.inode) if record.inode else index, []).append(index)
+        candidates.append(list(links.values()))
+
+    def split(candidates: list, hash_file, batch_size: int) -> list:
+        """Split every candidate by the digest of one file of each of its links."""
+        firsts = [records[link[0]] for candidate in candidates for link in candidate]
+        digests = iter(_map_in_threads(lambda record: hash_file(record.path, record.size), firsts, workers,
+                                       batch_size))
+        parts = []
+        for candidate in candidates:
+            by_digest = {}
+            for link in candidate:
+                digest = next(digests)
+                if digest is None:
+                    parts.append([link])  # Unreadable: only its own hard links are known to match.
+                else:
+                    by_digest.setdefault(digest, []).append(link)
+            parts.extend(by_digest.values())
+        return parts
+
+    settled.extend(candidate for candidate in candidates if len(candidate) == 1)
+    partial = split([candidate for candidate in candidates if len(candidate) > 1],
+                    lambda path, size: partial_hash(path, size, edge), 64)
+    full = []
+    for candidate in partial:
+        if len(candidate) > 1 and records[candidate[0][0]].size > 2 * edge:
+            full.append(candidate)
+        else:
+            settled.append(candidate)  # A single link, or fully covered by the partial hash.
+    settled.extend(split(full, full_hash, 1))
+    sets = [sorted(index for link in candidate for index in link) for candidate in settled]
+    return sorted((indices for indices in sets if len(indices) > 1), key=lambda indices: indices[0])
+
+
+HASH_SIZE = 8      # dHash and pHash have HASH_SIZE * HASH_SIZE = 64 bits.
+PHASH_SCALE = 32   # pHash takes the DCT of the image shrunk to PHASH_SCALE x PHASH_SCALE.
+_dct_matrices = {}
+
+
+def _dct_matrix(size: int):
+    """Orthonormal DCT-II matrix, so that M @ A @ M.T is the 2-D DCT of A."""
+    matrix = _dct_matrices.get(size)
+    if matrix is None:
+        import numpy as np
+        k = np.arange(size)
+        matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * size)) * np.sqrt(2 / size)
+        matrix[0] /= np.sqrt(2)
+        matrix = _dct_matrices[size] = matrix.astype(np.float32)
+    return matrix
+
+
+def _downscale(pixels, rows: int, cols: int):
+    """Shrink a 2-D array to rows x cols by averaging the block of pixels behind each output pixel."""
+    import numpy as np
+    height, width = pixels.shape
+    if height < rows or width < cols:  # Tiny images are blown up first, so every block is non-empty.
+        pixels = np.repeat(np.repeat(pixels, -(-rows // height), axis=0), -(-cols // width), axis=1)
+        height, width = pixels.shape
+    row_edges = np.linspace(0, height, rows + 1).astype(np.intp)
+    col_edges = np.linspace(0, width, cols + 1).astype(np.intp)
+    sums = np.add.reduceat(np.add.reduceat(pixels, row_edges[:-1], axis=0), col_edges[:-1], axis=1)
+    return sums / (np.diff(row_edges)[:, None] * np.diff(col_edges)[None, :])
+
+
+def _bits_to_int(bits) -> int:
+    import numpy as np
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def image_hashes(file_path: str):
+    """
+    Return the 64-bit (dHash, pHash) of an image, or () if it cannot be decoded.
+    dHash compares neighbouring pixels of the image shrunk to 9x8; pHash
+    compares the 8x8 lowest DCT frequencies (but the DC term) with their median.
+    Both survive resizing and recompression. The image is decoded with Pillow,
+    at a reduced size where the format allows (JPEG), and shrunk with NumPy.
+    Raises ImportError if NumPy or Pillow is not installed.
+    """
+    import numpy as np
+    from PIL import Image
+    try:
+        with Image.open(file_path) as img:
+            img.draft("L", (PHASH_SCALE * 4, PHASH_SCALE * 4))
+            pixels = np.asarray(img.convert("L"), dtype=np.float32)
+    except Exception:
+        return ()
+    if pixels.ndim != 2 or not pixels.size:
+        return ()
+    small = _downscale(pixels, HASH_SIZE, HASH_SIZE + 1)
+    dhash = _bits_to_int(small[:, 1:] > small[:, :-1])
+    dct = _dct_matrix(PHASH_SCALE)
+    frequencies = (dct @ _downscale(pixels, PHASH_SCALE, PHASH_SCALE) @ dct.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    phash = _bits_to_int(frequencies > np.median(frequencies[1:]))
+    return dhash, phash
+
+
+def _popcount64(values):
+    """Number of set bits of every element of a uint64 NumPy array."""
+    import numpy as np
+    if hasattr(np, "bitwise_count"):  # NumPy 2.0+
+        return np.bitwise_count(values)
+    table = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+    return table[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def _chunk_flips(width: int, radius: int) -> list:
+    """Every mask of width bits with at most radius bits set."""
+    from itertools import combinations
+    return [sum(1 << bit for bit in bits) for count in range(radius + 1) for bits in combinations(range(width), count)]
+
+
+def _multi_index_chunks(size: int, max_distance: int, bits: int = 64) -> int:
+    """
+    Number of chunks for multi-index hashing of size hashes: each chunk costs
+    one vectorized pass per flip mask plus the candidates it turns up.
+    """
+    from math import comb
+
+    def cost(chunks: int) -> float:
+        width = bits // chunks
+        flips = sum(comb(width, count) for count in range(max_distance // chunks + 1))
+        return chunks * flips * (size + size * size / 2 ** width)
+
+    return min(range(1, min(max_distance + 1, bits) + 1), key=cost)
+
+
+def similar_pairs(hashes, max_distance: int):
+    """
+    Find the pairs of 64-bit hashes within max_distance bits of each other,
+    using multi-index hashing rather than comparing every pair.
+    The bits are split into chunks; if two hashes are within max_distance bits,
+    then by the pigeonhole principle one of their chunks is within
+    max_distance // chunks bits. So for every chunk and every flip mask of that
+    many bits, each hash is joined (vectorized with NumPy) with the hashes whose
+    chunk equals its own chunk XOR the mask, and only those candidates are
+    compared in full.
+    Yields pairs of index arrays (first, second) into hashes, with first < second;
+    a pair may be yielded more than once.
+    """
+    import numpy as np
+    if max_distance < 0:
+        raise ValueError(f"Hamming distance must not be negative (got {max_distance}).")
+    values = np.asarray(hashes, dtype=np.uint64)
+    size = len(values)
+    if size < 2:
+        return
+    chunks = _multi_index_chunks(size, max_distance)
+    radius = max_distance // chunks
+    positions = np.arange(size)
+    shift = 0
+    for chunk in range(chunks):
+        width = 64 // chunks + (chunk < 64 % chunks)
+        keys = ((values >> np.uint64(shift)) & np.uint64((1 << width) - 1)).astype(np.int64)
+        shift += width
+        order = np.argsort(keys, kind="stable")
+        if width <= 24:
+            # Dense table of bucket boundaries: bucket k is order[starts[k]:starts[k + 1]].
+            starts = np.zeros((1 << width) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(keys, minlength=1 << width), out=starts[1:])
+        else:
+            sorted_keys = keys[order]
+        for flip in _chunk_flips(width, radius):
+            targets = keys ^ flip
+            if width <= 24:
+                low, high = starts[targets], starts[targets + 1]
+            else:
+                low = np.searchsorted(sorted_keys, targets, "left")
+                high = np.searchsorted(sorted_keys, targets, "right")
+            counts = high - low
+            total = int(counts.sum())
+            if not total:
+                continue
+            first = np.repeat(positions, counts)
+            # Offset of each candidate within its bucket, added to the bucket start.
+            within = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            second = order[np.repeat(low, counts) + within]
+            keep = first < second
+            first, second = first[keep], second[keep]
+            close = _popcount64(values[first] ^ values[second]) <= max_distance
+            if close.any():
+                yield first[close], second[close]
+
+
+def similar_sets(hashes: list, max_distance: int) -> list:
+    """
+    Cluster hashes that are within max_distance bits of each other, transitively.
+    hashes holds a 64-bit int (or None, for items to leave out) per item;
+    neighbours are found with similar_pairs. Returns lists of 2 or more item
+    indices, each in order, ordered by their first item.
+    """
+    parent = list(range(len(hashes)))
+
+    def find(index: int) -> int:
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    def union(a: int, b: int):
+        a, b = find(a), find(b)
+        if a != b:
+            parent[max(a, b)] = min(a, b)
+
+    # Equal hashes are merged up front, so only distinct values are searched.
+    first_with_hash = {}
+    for index, value in enumerate(hashes):
+        if value is not None:
+            union(index, first_with_hash.setdefault(value, index))
+    distinct = list(first_with_hash.values())
+    for first, second in similar_pairs([hashes[index] for index in distinct], max_distance):
+        for a, b in zip(first.tolist(), second.tolist()):
+            union(distinct[a], distinct[b])
+    clusters = {}
+    for index, value in enumerate(hashes):
+        if value is not None:
+            clusters.setdefault(find(index), []).append(index)
+    return sorted((indices for indices in clusters.values() if len(indices) > 1), key=lambda indices: indices[0])
+
+
+def probe_resolution(record: FileRecord):
+    """
+    Return the (width, height) of an image or video record, probing it only if needed.
+    The result is cached on the record; () means the file could not be probed.
+    """
+    if record.resolution is None:
+        resolution = None
+        if record.media_type == "image":
+            resolution = get_image_resolution(record.path)
+        elif record.media_type == "video":
+            resolution = get_video_resolution(record.path)
+        record.resolution = tuple(resolution) if resolution else ()
+    return record.resolution
+
+
+_probe_progress = None  # (start times, offsets) shared with the parent; set in each pool worker.
+
+
+def _init_probe_worker(started, offsets):
+    global _probe_progress
+    _probe_progress = (started, offsets)
+
+
+def _probe_resolution_batch(number: int, batch: list) -> list:
+    """
+    Process-pool worker: probe [(index, media_type, path)] and return [(index, resolution)].
+    Before each file, its offset in the batch and the time are recorded in
+    slot number of the shared arrays, so the parent can spot a file that hangs.
+    """
+    started, offsets = _probe_progress
+    results = []
+    for offset, (index, media_type, path) in enumerate(batch):
+        offsets[number] = offset
+        started[number] = time.monotonic()  # System-wide clock, comparable across processes.
+        if media_type == "image":
+            resolution = get_image_resolution(path)
+        else:
+            resolution = get_video_resolution(path)
+        results.append((index, tuple(resolution) if resolution else ()))
+    return results
+
+
+def probe_resolutions_parallel(items: list, workers: int, chunk_size: int = 64, timeout: float = 30.0) -> dict:
+    """
+    Probe the resolutions of [(index, media_type, path)] items on a process pool.
+    Items are sent in chunks of chunk_size, and the workers report when they
+    start each file. A file still running timeout seconds after it started is
+    given up as () ("could not be probed"): the pool is terminated, since its
+    worker may be stuck in a decoder, and the files whose results had not come
+    back yet are probed again in a fresh pool. A single corrupt file thus costs
+    about timeout seconds, rather than stalling the rest of the run.
+    Returns a dictionary mapping each index to its resolution.
+    """
+    import multiprocessing
+    results = {}
+    poll = max(0.05, min(1.0, timeout / 10))
+    while items:
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+        started = multiprocessing.RawArray('d', len(chunks))
+        offsets = multiprocessing.RawArray('i', len(chunks))
+        pool = multiprocessing.Pool(max(1, workers), _init_probe_worker, (started, offsets))
+        submitted = []
+        collected = 0
+        hung = None
+        try:
+            submitted = [pool.apply_async(_probe_resolution_batch, (number, chunk))
+                         for number, chunk in enumerate(chunks)]
+            while collected < len(chunks) and hung is None:
+                result = submitted[collected]
+                result.wait(poll)
+                if result.ready():
+                    try:
+                        results.update(result.get())
+                    except Exception:
+                        results.update((item[0], ()) for item in chunks[collected])
+                    collected += 1
+                    continue
+                # The pool hands out chunks in order, so the running ones are
+                # among those from here up to the first one not started yet.
+                now = time.monotonic()
+                for number in range(collected, len(chunks)):
+                    if not started[number]:
+                        break
+                    if not submitted[number].ready() and now - started[number] > timeout:
+                        hung = chunks[number][offsets[number]]
+                        break
+        finally:
+            if collected < len(chunks):
+                pool.terminate()  # A file hung, or we were interrupted: do not wait for the workers.
+            else:
+                pool.close()
+            pool.join()
+        if hung is None:
+            break
+        for result in submitted[collected:]:
+            if result.ready() and result.successful():
+                results.update(result.get())
+        results[hung[0]] = ()
+        items = [item for item in items if item[0] not in results]
+    return results
+
+
+def resolution_key(record: FileRecord) -> str:
+    """Group key for sorting by resolution ('unknown' for non-media or unreadable files)."""
+    resolution = probe_resolution(record)
+    if resolution:
+        return f"{resolution[0]}x{resolution[1]}"
+    return "unknown"
+
+
+GROUP_KEY_FUNCTIONS = {
+    "extension": extension_key,
+    "media_type": media_type_key,
+    "resolution": resolution_key,
+}
+
+
+class GroupSpiller:
+    """
+    Write group members to disk incrementally, one text file per group.
+    Only a bounded number of group files are kept open at a time; the least
+    recently used one is closed (and later reopened for appending) when needed.
+    """
+
+    def __init__(self, spill_dir: str, max_open_files: int = 64):
+        self.spill_dir = spill_dir
+        self.max_open_files = max_open_files
+        self.paths = {}    # Group key -> spill file path.
+        self.counts = {}   # Group key -> number of files written.
+        self.handles = OrderedDict()
+        os.makedirs(spill_dir, exist_ok=True)
+
+    def _handle(self, key: str):
+        handle = self.handles.get(key)
+        if handle is not None:
+            self.handles.move_to_end(key)
+            return handle
+        if len(self.handles) >= self.max_open_files:
+            _, oldest = self.handles.popitem(last=False)
+            oldest.close()
+        if key in self.paths:
+            mode = "a"
+        else:
+            name = f"{len(self.paths):05d}_{clean_folder_name(key) or 'group'}.txt"
+            self.paths[key] = os.path.join(self.spill_dir, name)
+            mode = "w"
+        handle = open(self.paths[key], mode, encoding="utf-8", errors="surrogateescape", buffering=1 << 16)
+        self.handles[key] = handle
+        return handle
+
+    def add(self, key: str, file_path: str):
+        """Append a file path to the given group."""
+        self._handle(key).write(file_path + "\n")
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def close(self) -> dict:
+        """Flush and close all group files. Returns {group key: (count, spill file path)}."""
+        while self.handles:
+            _, handle = self.handles.popitem(last=False)
+            handle.close()
+        return {key: (self.counts[key], path) for key, path in self.paths.items()}
+
+
+MEDIA_FOLDERS = {
+    "image": "images",
+    "video": "videos",
+    "audio": "audio",
+    "misc": "misc",
+}
+
+
+def hierarchy_group(record: FileRecord) -> str:
+    """Return the 'media_folder/ext_folder' group a file belongs to in the media hierarchy."""
+    media_folder = MEDIA_FOLDERS.get(record.media_type, "others")
+    if record.ext:
+        ext_folder = clean_folder_name(record.ext.lstrip('.'))
+    else:
+        ext_folder = "no_extension"
+    return os.path.join(media_folder, ext_folder)
+
+
+class PlannedMove:
+    """A single source-to-destination move in a move plan."""
+
+    def __init__(self, record: FileRecord, dest_path: str, group_key: str, in_place: bool = None):
+        self.record = record
+        self.source = record.path
+        self.dest_path = dest_path
+        self.group_key = group_key
+        # Nothing to do: the file stays put, or dest_path already places it (from an earlier run).
+        self.in_place = dest_path == self.source if in_place is None else in_place
+
+    @property
+    def target_folder(self) -> str:
+        return os.path.dirname(self.dest_path)
+
+    def __repr__(self):
+        return f"PlannedMove({self.source!r} -> {self.dest_path!r})"
+
+
+class MoveCostEstimate:
+    """
+    Predicted cost of executing a move plan, computed from cached stat data only.
+    The wall time uses simple throughput assumptions that can be tuned for the
+    hardware at hand: renames (or links) per second, a fixed overhead per copied
+    file and the sustained copy bandwidth in bytes per second.
+    renames counts every placement done without copying data for the given
+    placement mode (reflinks are assumed to be supported on the target
+    filesystem); copies includes the cross-device fallbacks.
+    """
+
+    def __init__(self, plan: list, engine: "MoveEngine", mode: str = "move", rename_rate: float = 5000.0,
+                 copy_overhead: float = 0.002, copy_bandwidth: float = 200e6):
+        self.plan = plan
+        self.mode = mode
+        self.unchanged = 0
+        self.renames = 0
+        self.copies = 0
+        self.copy_bytes = 0
+        for move in plan:
+            if move.in_place:
+                self.unchanged += 1
+                continue
+            dest_dev = engine.planned_folder_device(move.target_folder)
+            same_device = dest_dev is not None and dest_dev == move.record.dev
+            if mode == "symlink" or (mode != "copy" and same_device):
+                self.renames += 1
+            else:
+                self.copies += 1
+                self.copy_bytes += move.record.size
+        self.estimated_seconds = (self.renames / rename_rate + self.copies * copy_overhead
+                                  + self.copy_bytes / copy_bandwidth)
+
+    def __str__(self):
+        minutes, seconds = divmod(int(round(self.estimated_seconds)), 60)
+        hours, minutes = divmod(minutes, 60)
+        fast = {"move": "same-device renames", "hardlink": "hard links",
+                "reflink": "reflink clones", "symlink": "symlinks"}.get(self.mode, "links")
+        return (f"{len(self.plan)} files: {self.renames} {fast}, "
+                f"{self.copies} {'cross-device copies' if self.mode == 'move' else 'copies'} "
+                f"({self.copy_bytes / 1e6:.1f} MB), "
+                f"{self.unchanged} already in place. "
+                f"Estimated time: {hours}h {minutes:02d}m {seconds:02d}s")
+
+
+def default_state_dir() -> str:
+    """Directory for FileSorter's own state (journals, catalogs), outside any sorted tree."""
+    return os.path.join(os.path.expanduser("~"), ".filesorter")
+
+
+def default_view_root(root_folder: str) -> str:
+    """Folder next to root_folder in which the non-move placement modes build their hierarchy."""
+    return os.path.normpath(os.path.abspath(root_folder)) + "_sorted"
+
+
+def _is_placement(src: str, dest: str, mode: str) -> bool:
+    """
+    Whether dest already places src as the (non-move) placement mode does: a
+    symlink to it, a hard link to it, or else a complete copy (the fallback of every mode).
+    """
+    try:
+        if mode == "symlink" and os.path.islink(dest) and os.readlink(dest) == os.path.abspath(src):
+            return True
+        if mode == "hardlink":
+            src_stat, dest_stat = os.lstat(src), os.lstat(dest)
+            if (src_stat.st_dev, src_stat.st_ino) == (dest_stat.st_dev, dest_stat.st_ino):
+                return True
+        return _is_complete_copy(src, dest)
+    except OSError:
+        return False
+
+
+def _placements_in(folder: str) -> dict:
+    """
+    Index the entries of an existing view folder by what they may place: a
+    symlink by its target, every entry by its inode and by its size and mtime.
+    Maps each key to the list of names with it.
+    """
+    found = {}
+    try:
+        entries = os.scandir(folder)
+    except OSError:
+        return found
+    with entries:
+        for entry in entries:
+            try:
+                keys = [("link", os.readlink(entry.path))] if entry.is_symlink() else []
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            keys += [("inode", st.st_dev, st.st_ino), ("copy", st.st_size, st.st_mtime)]
+            for key in keys:
+                found.setdefault(key, []).append(entry.name)
+    return found
+
+
+def default_journal_path(root_folder: str) -> str:
+    """Return the move journal path used for a root folder."""
+    import hashlib
+    digest = hashlib.sha1(os.path.abspath(root_folder).encode("utf-8", "surrogateescape")).hexdigest()[:16]
+    return os.path.join(default_state_dir(), "journals", f"{digest}.jsonl")
+
+
+class MoveJournal:
+    """
+    Append-only journal of a move plan and its progress, one JSON object per line.
+    The plan is written and fsync'd before the first file moves; each finished
+    move is then appended and fsync'd in batches of FSYNC_BATCH entries. A
+    journal can be loaded to resume an interrupted run or to undo a finished one.
+    """
+
+    FSYNC_BATCH = 1000
+    VERSION = 1
+
+    def __init__(self, path: str):
+        self.path = path
+        self._handle = open(path, "a", encoding="utf-8", errors="surrogateescape", buffering=1 << 20)
+        self._unsynced = 0
+
+    @classmethod
+    def create(cls, path: str, root_folder: str, plan: list, mode: str = "move") -> "MoveJournal":
+        """
+        Start a new journal for a plan, replacing any previous journal at path.
+        Paths are journaled as absolute paths, so the journal can be resumed or
+        undone from any working directory.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        open(path, "w").close()
+        journal = cls(path)
+        journal._write({"op": "begin", "version": cls.VERSION, "root": os.path.abspath(root_folder), "count": len(plan),
+                        "mode": mode})
+        for index, move in enumerate(plan):
+            record = move.record
+            journal._write({"op": "plan", "i": index, "src": os.path.abspath(move.source),
+                            "dst": os.path.abspath(move.dest_path),
+                            "group": move.group_key, "size": record.size, "mtime": record.mtime,
+                            "inode": record.inode, "dev": record.dev, "symlink": record.is_symlink})
+        journal.sync()
+        return journal
+
+    def _write(self, entry: dict):
+        self._handle.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def sync(self):
+        """Flush the journal and fsync it to disk."""
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+        self._unsynced = 0
+
+    def _append(self, entry: dict):
+        self._write(entry)
+        self._unsynced += 1
+        if self._unsynced >= self.FSYNC_BATCH:
+            self.sync()
+
+    def record_done(self, index: int, dest_path: str):
+        """Record that planned move index now lives at dest_path."""
+        self._append({"op": "done", "i": index, "dst": os.path.abspath(dest_path)})
+
+    def record_undone(self, index: int):
+        """Record that planned move index was moved back to its source."""
+        self._append({"op": "undone", "i": index})
+
+    def complete(self):
+        """Mark the plan as fully executed."""
+        self._append({"op": "complete"})
+        self.sync()
+
+    def close(self):
+        self.sync()
+        self._handle.close()
+
+    @staticmethod
+    def load(path: str) -> dict:
+        """
+        Read a journal back.
+        Returns a dictionary with the root folder, the placement mode, the
+        planned moves (list of plan entries), done (index -> destination),
+        undone (set of indexes) and complete (bool). A line torn by a crash at
+        the end is ignored.
+        """
+        state = {"root": None, "mode": "move", "moves": [], "done": {}, "undone": set(), "complete": False}
+        with open(path, encoding="utf-8", errors="surrogateescape") as handle:
+            for line in handle:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                op = entry.get("op")
+                if op == "begin":
+                    state["root"] = entry["root"]
+                    state["mode"] = entry.get("mode", "move")
+                elif op == "plan":
+                    state["moves"].append(entry)
+                elif op == "done":
+                    state["done"][entry["i"]] = entry["dst"]
+                    state["undone"].discard(entry["i"])
+                elif op == "undone":
+                    state["undone"].add(entry["i"])
+                elif op == "complete":
+                    state["complete"] = True
+        return state
+
+
+def undo_moves(journal_path: str, engine: "MoveEngine" = None, reporter: ProgressReporter = None) -> int:
+    """
+    Replay a move journal backwards, moving every completed move back to its source.
+    For the non-move placement modes the sources were never touched, so the
+    links or copies are simply removed.
+    Each restored file is journaled, so an interrupted undo can simply be run
+    again. Target folders left empty are removed. A source path that has been
+    taken by another file in the meantime is left alone and reported.
+    Returns the number of files restored.
+    """
+    state = MoveJournal.load(journal_path)
+    engine = engine or MoveEngine()
+    own_reporter = reporter is None
+    if own_reporter:
+        reporter = ProgressReporter(len(set(state["done"]) - state["undone"]))
+    journal = MoveJournal(journal_path)
+    dir_cache = DirectoryCache()
+    restored = 0
+    emptied = set()
+    try:
+        for entry in reversed(state["moves"]):
+            index = entry["i"]
+            dest_path = state["done"].get(index)
+            if dest_path is None or index in state["undone"]:
+                continue
+            source = entry["src"]
+            if dest_path == source:
+                journal.record_undone(index)
+                continue
+            if state["mode"] != "move":
+                try:
+                    os.unlink(dest_path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    reporter.failure(f"Failed to remove {dest_path}: {str(e)}")
+                    continue
+                journal.record_undone(index)
+                emptied.add(os.path.dirname(dest_path))
+                restored += 1
+                reporter.success(f"Removed {dest_path}")
+                continue
+            try:
+                dir_cache.ensure(os.path.dirname(source))
+                os.close(os.open(source, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            except OSError as e:
+                reporter.failure(f"Cannot restore {dest_path} to {source}: {str(e)}")
+                continue
+            try:
+                engine.move(dest_path, source)
+            except Exception as e:
+                os.unlink(source)
+                reporter.failure(f"Failed to restore {dest_path} to {source}: {str(e)}")
+                continue
+            journal.record_undone(index)
+            emptied.add(os.path.dirname(dest_path))
+            restored += 1
+            reporter.success(f"Restored {dest_path} to {source}", entry["size"])
+    finally:
+        journal.close()
+        if own_reporter:
+            reporter.close()
+    root = os.path.abspath(state["root"]) if state["root"] else None
+    for folder in sorted(emptied, reverse=True):
+        # Remove the hierarchy folders that are now empty, up to the root folder.
+        while folder and os.path.abspath(folder) != root:
+            try:
+                os.rmdir(folder)
+            except OSError:
+                break
+            folder = os.path.dirname(folder)
+    return restored
+
+
+DISPLAY_FORMATS = ("text", "ndjson", "summary")
+DISPLAY_BATCH_LINES = 8192  # Lines joined into a single write by display_sorted_files.
+_json_string = json.encoder.encode_basestring_ascii  # Quote and escape a string as JSON.
+
+
+class FileOrganizer:
+    """Handles scanning, sorting, moving, and applying actions to files."""
+    
+    def __init__(self, root_folder: str, catalog: ScanCatalog = None, resolution_cache: ResolutionCache = None):
+        self.root_folder = root_folder
+        self.catalog = catalog  # Optional ScanCatalog for incremental rescans.
+        self.resolution_cache = resolution_cache  # Optional ResolutionCache shared across runs.
+        self.entries = FileTable()  # FileRecord of every discovered file, in scan order.
+        self.groups = {}        # Dictionary mapping group key to an array of indices into entries.
+        self.name_index = NameIndex()  # Names taken in the move targets of the current plan.
+        self.move_engine = MoveEngine()
+        self.dir_cache = DirectoryCache()  # Folders created or found during this run.
+    
+    def scan_files(self, workers: int = 1):
+        """
+        Recursively scan for files in the root folder, caching their stat data.
+        With workers > 1 the directories are listed in parallel (useful on
+        network filesystems); the resulting file order is the same either way.
+        If a catalog is attached, unchanged directories are read from it instead.
+        """
+        if self.catalog is not None:
+            scanner = scan_directory_incremental(self.root_folder, self.catalog, tables=True)
+        elif workers > 1:
+            scanner = scan_directory_parallel(self.root_folder, workers, tables=True)
+        else:
+            scanner = scan_directory(self.root_folder, tables=True)
+        for records in scanner:
+            self.entries.extend(records)
+
+    @property
+    def files(self) -> RecordPaths:
+        """The paths of all discovered files, in scan order."""
+        return RecordPaths(self.entries)
+
+    @property
+    def sorted_files(self) -> dict:
+        """Dictionary mapping each group key to the paths of the files in that group."""
+        return {key: RecordPaths(self.entries, indices) for key, indices in self.groups.items()}
+    
+    def _sort_by_key(self, key_function):
+        """Group the scanned files by the key computed from their records."""
+        groups = {}
+        for index, record in enumerate(self.entries):
+            key = key_function(record)
+            indices = groups.get(key)
+            if indices is None:
+                indices = groups[key] = array("I")
+            indices.append(index)
+        self.groups = groups
+
+    def sort_by_extension(self, sniff: bool = False):
+        """
+        Sort files by their file extension.
+        With sniff, files are first identified by their content (see sniff_contents),
+        and a missing or contradicting extension is replaced by the detected one.
+        """
+        if sniff:
+            self.sniff_contents()
+            self._sort_by_key(content_extension_key)
+        else:
+            self._sort_by_key(extension_key)
+    
+    def sort_by_media_type(self, sniff: bool = False):
+        """
+        Sort files by media type (image, video, audio, other).
+        With sniff, the media type follows the file's content, as in sort_by_extension.
+        """
+        if sniff:
+            self.sniff_contents()
+            self._sort_by_key(content_media_type_key)
+        else:
+            self._sort_by_key(media_type_key)
+
+    def sort_by_duplicates(self, workers: int = 8):
+        """
+        Group byte-identical files, found with duplicate_sets on workers threads.
+        Each set of identical files becomes a group 'duplicates_N', numbered in
+        scan order; every other file is in the group 'unique'.
+        """
+        groups = {}
+        duplicates = set()
+        for number, indices in enumerate(duplicate_sets(self.entries, workers), start=1):
+            groups[f"duplicates_{number}"] = array("I", indices)
+            duplicates.update(indices)
+        unique = array("I", (index for index in range(len(self.entries)) if index not in duplicates))
+        if unique:
+            groups["unique"] = unique
+        self.groups = groups
+
+    def sort_by_similarity(self, max_distance: int = 8, method: str = "phash", workers: int = 8):
+        """
+        Group visually similar images: resized copies, recompressed JPEGs and the like.
+        Images whose hashes (see image_hashes; method 'phash' or 'dhash') are
+        within max_distance bits, directly or through others, form groups
+        'similar_N' (see similar_sets); the other images are in 'unique' and
+        everything else in 'not_image'. Hashes are computed on workers threads
+        and kept in the catalog. Raises ImportError without NumPy or Pillow.
+        """
+        if method not in ("phash", "dhash"):
+            raise ValueError(f"Unknown image hash method '{method}'.")
+        if max_distance < 0:
+            raise ValueError(f"Hamming distance must not be negative (got {max_distance}).")
+        # Fail before any file is read if NumPy or Pillow is missing.
+        import numpy
+        import PIL
+        image_code = MEDIA_TYPE_CODES["image"]
+        pending = [record for record in self.entries if record.media_code == image_code and record.image_hash is None]
+        if pending:
+            for record, image_hash in zip(pending, _map_in_threads(lambda r: image_hashes(r.path), pending,
+                                                                   workers, 16)):
+                record.image_hash = image_hash
+            if self.catalog is not None:
+                self.catalog.store_image_hashes(pending)
+        position = 0 if method == "dhash" else 1
+        hashes = [record.image_hash[position] if record.media_code == image_code and record.image_hash else None
+                  for record in self.entries]
+        groups = {}
+        similar = set()
+        for number, indices in enumerate(similar_sets(hashes, max_distance), start=1):
+            groups[f"similar_{number}"] = array("I", indices)
+            similar.update(indices)
+        unique = array("I", (index for index, value in enumerate(hashes) if value is not None and index not in similar))
+        not_image = array("I", (index for index, value in enumerate(hashes) if value is None))
+        for key, indices in (("unique", unique), ("not_image", not_image)):
+            if indices:
+                groups[key] = indices
+        self.groups = groups
+
+    def sort_by_date(self, granularity: str = "month", workers: int = 8):
+        """
+        Group files by the date they were captured (see capture_date), per year
+        ('2024'), month ('2024-07') or day ('2024-07-14') as given by granularity.
+        The EXIF capture time of JPEG, TIFF, camera raw and HEIF images is read
+        from their headers on workers threads, without decoding them; other files
+        and images without one fall back to their modification time.
+        Groups are ordered by date.
+        """
+        length = DATE_GRANULARITIES.get(granularity)
+        if length is None:
+            raise ValueError(f"Unknown date granularity '{granularity}'.")
+        pending = [record for record in self.entries
+                   if record.capture_time is None and classified_extension(record) in EXIF_EXTENSIONS]
+        for record, capture_time in zip(pending, _map_in_threads(lambda r: read_exif_datetime(r.path), pending,
+                                                                  workers, 64)):
+            record.capture_time = capture_time
+        self._sort_by_key(lambda record: capture_date(record)[:length] or "unknown_date")
+        self.groups = dict(sorted(self.groups.items()))
+
+    def sniff_contents(self, workers: int = 8) -> list:
+        """
+        Identify every file from its header bytes, against CONTENT_SIGNATURES.
+        Only files not sniffed before (in this run or, with a catalog, an
+        earlier one) are read, workers threads at a time; the results are
+        written back to the catalog.
+        Returns the records of the files whose content contradicts their extension.
+        """
+        pending = [record for record in self.entries if record.content_ext is None]
+        if pending:
+            sniff_files(pending, workers)
+            if self.catalog is not None:
+                self.catalog.store_contents(pending)
+        return [record for record in self.entries
+                if record.ext and record.content_ext and not content_matches_extension(record.content_ext, record.ext)]
+    
+    def sort_by_resolution(self, workers: int = 1, chunk_size: int = 64, timeout: float = 30.0):
+        """
+        Sort files by resolution (only for images and videos).
+        Files whose resolution is already known from the catalog or the
+        resolution cache are not reopened, and newly probed resolutions are
+        written back to both.
+        With workers > 1 the files are probed on a process pool in chunks of
+        chunk_size, giving up on any file that takes longer than timeout seconds;
+        the groups come out in the same order as a sequential run.
+        """
+        unknown = [record for record in self.entries
+                   if record.resolution is None and record.media_type in ("image", "video")]
+        pending = unknown
+        if self.resolution_cache is not None:
+            pending = self.resolution_cache.fill(unknown)
+        if workers > 1:
+            items = [(index, record.media_type, record.path) for index, record in enumerate(pending)]
+            for index, resolution in probe_resolutions_parallel(items, workers, chunk_size, timeout).items():
+                pending[index].resolution = resolution
+        self._sort_by_key(resolution_key)
+        if self.resolution_cache is not None:
+            self.resolution_cache.store(pending)
+        if self.catalog is not None:
+            self.catalog.store_resolutions(unknown)  # Only what was not in the catalog already.
+
+    def stream_groups(self, criteria: str, spill_dir: str, workers: int = 1) -> dict:
+        """
+        Scan, classify and group files as a single streaming pass.
+        Nothing is kept in self.entries or self.groups: each file path is
+        appended to its group's file in spill_dir as soon as it is classified,
+        so memory stays bounded however large the tree is.
+        criteria is one of the keys of GROUP_KEY_FUNCTIONS.
+        Returns a dictionary mapping group keys to (file count, spill file path).
+        """
+        key_function = GROUP_KEY_FUNCTIONS[criteria]
+        if workers > 1:
+            scanner = scan_directory_parallel(self.root_folder, workers, ordered=False)
+        else:
+            scanner = scan_directory(self.root_folder)
+        spiller = GroupSpiller(spill_dir)
+        try:
+            for record in scanner:
+                spiller.add(key_function(record), record.path)
+        finally:
+            groups = spiller.close()
+        return groups
+    
+    def display_sorted_files(self, output: str = "text", stream=None):
+        """
+        Display the sorted groups on stream (default: standard output).
+        output is one of DISPLAY_FORMATS:
+          'text':    each group key followed by the files in that group
+          'ndjson':  one JSON object per file with its path, group, size, media
+                     type and resolution ([width, height], or null if unknown)
+          'summary': only the file count and byte total of each group
+        Lines are joined and written in large batches rather than one at a time.
+        """
+        if output not in DISPLAY_FORMATS:
+            raise ValueError(f"Unknown output format '{output}'.")
+        stream = stream or sys.stdout
+        lines = []
+
+        def emit(line: str):
+            lines.append(line)
+            if len(lines) >= DISPLAY_BATCH_LINES:
+                stream.write("\n".join(lines) + "\n")
+                lines.clear()
+
+        entries = self.entries
+        total_files = total_bytes = 0
+        for key, indices in self.groups.items():
+            if output == "ndjson":
+                # Formatted directly rather than through json.dumps, which is an
+                # order of magnitude slower per record; only the strings need escaping.
+                group = _json_string(key)
+                for index in indices:
+                    record = entries[index]
+                    resolution = record.resolution
+                    emit(f'{{"path": {_json_string(record.path)}, "group": {group}, "size": {record.size}, '
+                         f'"media_type": {_json_string(record.media_type)}, "resolution": '
+                         f'{f"[{resolution[0]}, {resolution[1]}]" if resolution else "null"}}}')
+            elif output == "summary":
+                group_bytes = sum(entries[index].size for index in indices)
+                total_files += len(indices)
+                total_bytes += group_bytes
+                emit(f"Group: {key} ({len(indices)} file{'s' if len(indices) != 1 else ''}, {group_bytes} bytes)")
+            else:
+                emit(f"Group: {key} ({len(indices)} file{'s' if len(indices) != 1 else ''})")
+                for index in indices:
+                    emit(f"  {entries[index].path}")
+                emit("")
+        if output == "summary":
+            emit(f"Total: {total_files} file{'s' if total_files != 1 else ''}, {total_bytes} bytes "
+                 f"in {len(self.groups)} group{'s' if len(self.groups) != 1 else ''}")
+        if lines:
+            stream.write("\n".join(lines) + "\n")
+        stream.flush()
+
+    def group_summary(self) -> dict:
+        """Return a dictionary mapping each group key to its file count and byte total."""
+        return {key: {"files": len(indices), "bytes": sum(self.entries[index].size for index in indices)}
+                for key, indices in self.groups.items()}
+    
+    def plan_hierarchy_moves(self, mode: str = "move", target_root: str = None) -> list:
+        """
+        Plan the placements into the media hierarchy under target_root, touching no file.
+        target_root defaults to the root folder when moving and to
+        default_view_root otherwise. Name collisions are resolved up front as in
+        move_file_to_folder. A file already in its target folder (or, for the
+        other modes, already placed there by an earlier run) stays where it is,
+        and a view inside the root folder is left out. Returns PlannedMoves in scan order.
+        """
+        if target_root is None:
+            target_root = self.root_folder if mode == "move" else default_view_root(self.root_folder)
+        view = None
+        relative = os.path.relpath(os.path.abspath(target_root), os.path.abspath(self.root_folder))
+        if relative != os.curdir and relative != os.pardir and not relative.startswith(os.pardir + os.sep):
+            view = os.path.join(self.root_folder, relative)
+        plan = []
+        self.name_index = NameIndex()
+        placements = {}  # Target folder -> (_placements_in index of its entries, names claimed so far).
+        for record in self.entries:
+            if view is not None and (record.directory == view or record.directory.startswith(view + os.sep)):
+                continue
+            group_key = hierarchy_group(record)
+            target_folder = os.path.join(target_root, group_key)
+            if record.directory == target_folder:
+                plan.append(PlannedMove(record, record.path, group_key))
+                continue
+            if mode != "move":
+                existing = placements.get(target_folder)
+                if existing is None:
+                    existing = placements[target_folder] = (_placements_in(target_folder), set())
+                placed = self._earlier_placement(record, target_folder, mode, *existing)
+                if placed is not None:
+                    plan.append(PlannedMove(record, placed, group_key, in_place=True))
+                    continue
+            name = self.name_index.reserve(target_folder, record.name)
+            plan.append(PlannedMove(record, os.path.join(target_folder, name), group_key))
+        return plan
+
+    @staticmethod
+    def _earlier_placement(record: FileRecord, target_folder: str, mode: str, found: dict, claimed: set):
+        """Path in target_folder that already places record (adding its name to claimed), or None."""
+        for key in (("link", os.path.abspath(record.path)), ("inode", record.dev, record.inode),
+                    ("copy", record.size, record.mtime)):
+            for name in found.get(key, ()):
+                if name not in claimed and _is_placement(record.path, os.path.join(target_folder, name), mode):
+                    claimed.add(name)
+                    return os.path.join(target_folder, name)
+        return None
+
+    def execute_move_plan(self, plan: list, journal: MoveJournal = None, completed: dict = None,
+                          mode: str = "move", reporter: ProgressReporter = None) -> dict:
+        """
+        Apply a plan built by plan_hierarchy_moves through the organizer's MoveEngine, in mode (see PLACEMENT_MODES).
+        Finished moves go to journal, if given; completed maps moves already
+        done (when resuming) to their destinations. A reporter without totals
+        is sized for the moves left to do. The entries become the moved files,
+        grouped by hierarchy group; returns their sorted_files.
+        """
+        moved = dict(completed or {})
+        # Files already in place are neither moved nor counted.
+        pending = [move for index, move in enumerate(plan) if index not in moved and not move.in_place]
+        own_reporter = reporter is None
+        if own_reporter:
+            reporter = ProgressReporter()
+        if reporter.total_files is None:
+            reporter.total_files = len(pending)
+            reporter.total_bytes = sum(move.record.size for move in pending)
+        order = sorted(range(len(plan)), key=lambda i: (plan[i].record.dev, plan[i].target_folder))
+        # Create the whole target hierarchy up front, once per folder.
+        failed_folders = self.dir_cache.ensure_all(plan[i].target_folder for i in order if i not in moved)
+
+        def jobs():
+            for index in order:
+                move = plan[index]
+                if index in moved:
+                    continue
+                if move.in_place:
+                    moved[index] = move.dest_path
+                    if journal is not None:
+                        journal.record_done(index, move.dest_path)
+                    continue
+                try:
+                    if move.target_folder in failed_folders:
+                        raise failed_folders[move.target_folder]
+                    dest_path = claim_destination(move.target_folder, os.path.basename(move.source),
+                                                  self.name_index, move.dest_path)
+                except Exception as e:
+                    reporter.failure(f"Failed to move {move.source} to {move.target_folder}: {str(e)}")
+                    continue
+                yield index, move.source, dest_path, move.record.dev
+
+        try:
+            for index, dest_path, error in self.move_engine.run(jobs(), mode):
+                source = plan[index].source
+                if error is None:
+                    moved[index] = dest_path
+                    if journal is not None:
+                        journal.record_done(index, dest_path)
+                    reporter.success(f"{'Moved' if mode == 'move' else 'Placed'} {source} to {dest_path}",
+                                     plan[index].record.size)
+                else:
+                    try:
+                        os.unlink(dest_path)
+                    except OSError:
+                        pass
+                    reporter.failure(f"Failed to move {source} to {plan[index].target_folder}: {str(error)}")
+        finally:
+            if own_reporter:
+                reporter.close()
+        if journal is not None:
+            journal.complete()
+        by_group = {}
+        for index, move in enumerate(plan):
+            if index not in moved:
+                continue
+            move.record.relocate(moved[index])
+            by_group.setdefault(move.group_key, []).append(move.record)
+        # Update the entries to reflect moved files; each group is a contiguous run of them.
+        self.entries = FileTable()
+        self.groups = {}
+        for group_key, records in by_group.items():
+            self.groups[group_key] = array("I", range(len(self.entries), len(self.entries) + len(records)))
+            self.entries.extend(records)
+        return self.sorted_files
+
+    def move_files_to_hierarchy(self, journal_path: str = None, mode: str = "move",
+                                reporter: ProgressReporter = None, target_root: str = None):
+        """
+        Move each file to a two-level folder structure under the root folder:
+          First level: media type (images, videos, audio, others)
+          Second level: file extension (without dot) or 'no_extension'
+        mode is one of PLACEMENT_MODES: 'hardlink', 'reflink', 'symlink' or 'copy'
+        build the hierarchy as a view next to the original layout instead of moving,
+        under target_root (see plan_hierarchy_moves); rerunning updates the view.
+        If journal_path is given, the plan and every completed move are journaled
+        there, so an interrupted run can be resumed (resume_moves) or reverted (undo_moves).
+        Returns a dictionary mapping group keys (e.g., 'images/jpg') to sequences of new file paths.
+        """
+        if mode not in PLACEMENT_MODES:
+            raise ValueError(f"Unknown placement mode '{mode}'.")
+        plan = self.plan_hierarchy_moves(mode, target_root)
+        if journal_path is None:
+            return self.execute_move_plan(plan, mode=mode, reporter=reporter)
+        journal = MoveJournal.create(journal_path, self.root_folder, plan, mode)
+        try:
+            return self.execute_move_plan(plan, journal, mode=mode, reporter=reporter)
+        finally:
+            journal.close()
+
+    def estimate_hierarchy_moves(self, mode: str = "move", target_root: str = None,
+                                 **throughput) -> MoveCostEstimate:
+        """
+        Dry run of move_files_to_hierarchy: plan the moves and estimate their cost without moving anything.
+        Keyword arguments go to MoveCostEstimate; the plan is its plan attribute.
+        """
+        return MoveCostEstimate(self.plan_hierarchy_moves(mode, target_root), self.move_engine, mode, **throughput)
+
+    def resume_moves(self, journal_path: str, reporter: ProgressReporter = None):
+        """
+        Finish an interrupted move_files_to_hierarchy run from its journal, without rescanning.
+        Moves journaled as done are skipped. For the others, a file that is no
+        longer at its source but is found at its planned destination counts as
+        moved (its completion was not yet fsync'd). For a file still at its
+        source, a complete copy at the planned destination (made just before the
+        crash) counts as moved once the source is removed; anything else there,
+        such as the placeholder claimed for it, is removed and the move redone.
+        For the link and copy placement modes, a destination that already places
+        the source (see _is_placement) counts as placed, anything else there is
+        removed and redone. Moves found complete are journaled as done, so
+        they can be undone.
+        The organizer's files and records are rebuilt from the journal.
+        Returns the new locations, as move_files_to_hierarchy does.
+        """
+        state = MoveJournal.load(journal_path)
+        plan = []
+        completed = dict(state["done"])
+        recovered = []
+        records = FileTable()
+        for entry in state["moves"]:
+            directory, name = os.path.split(entry["src"])
+            record = records[records.append(name, directory, entry["size"], entry["mtime"], entry["inode"],
+                                            entry["dev"], entry["symlink"])]
+            move = PlannedMove(record, entry["dst"], entry["group"])
+            index = entry["i"]
+            plan.append(move)
+            if index in completed or move.dest_path == move.source:
+                continue
+            _remove_if_exists(_temp_path(move.dest_path))  # A copy cut short by the crash.
+            if state["mode"] != "move":
+                if os.path.lexists(move.dest_path):
+                    if _is_placement(move.source, move.dest_path, state["mode"]):
+                        completed[index] = move.dest_path
+                        recovered.append(index)
+                    else:
+                        os.unlink(move.dest_path)
+                continue
+            if not os.path.lexists(move.dest_path):
+                continue
+            if not os.path.lexists(move.source):
+                completed[index] = move.dest_path
+                recovered.append(index)
+            elif _is_complete_copy(move.source, move.dest_path):
+                os.unlink(move.source)  # Copied, but the source was not removed yet.
+                completed[index] = move.dest_path
+                recovered.append(index)
+            else:
+                os.unlink(move.dest_path)
+        self.entries = records
+        self.groups = {}
+        self.name_index = NameIndex()
+        for move in plan:
+            self.name_index.add(move.target_folder, os.path.basename(move.dest_path))
+        journal = MoveJournal(journal_path)
+        try:
+            for index in recovered:
+                journal.record_done(index, completed[index])
+            return self.execute_move_plan(plan, journal, completed, state["mode"], reporter)
+        finally:
+            journal.close()
+    
+    def apply_action(self, group_key: str, action, reporter: ProgressReporter = None):
+        """
+        Apply the given action function to each file in the specified group.
+        The action function should accept two parameters: file_path and index.
+        An action with a true uses_record attribute is also passed the file's
+        FileRecord as record, so it can use the classification cached at scan time.
+        If the action returns a new path (e.g. after a rename), the file's record
+        is updated so later steps do not need to rescan.
+        Progress goes to reporter (a ProgressReporter for the group is created
+        if none is given).
+        """
+        if group_key not in self.groups:
+            print_error(f"Group '{group_key}' not found.")
+            return
+        indices = self.groups[group_key]
+        uses_record = getattr(action, "uses_record", False)
+        own_reporter = reporter is None
+        if own_reporter:
+            reporter = ProgressReporter(len(indices))
+        try:
+            for idx, index in enumerate(indices, start=1):
+                record = self.entries[index]
+                file = record.path
+                try:
+                    new_path = action(file, idx, record=record) if uses_record else action(file, idx)
+                    if new_path and new_path != file:
+                        record.relocate(new_path)
+                    reporter.success(f"Action applied to: {file}", record.size)
+                except ActionSkipped as e:
+                    reporter.skip(f"Skipped {file}: {str(e)}")
+                except Exception as e:
+                    reporter.failure(f"Failed to apply action on {file}: {str(e)}")
+        finally:
+            if own_reporter:
+                reporter.close()
+
+
+class ActionSkipped(Exception):
+    """Raised by an action function to leave a file alone without it counting as a failure."""
+
+
+def create_rename_action(new_name_pattern: str):
+    """
+    Return an action function that renames files using the given pattern.
+    Use placeholders in the pattern:
+      {basename} - original file name (without extension)
+      {index}    - sequential index (starting at 1)
+    """
+    def action(file_path: str, index: int):
+        ext = os.path.splitext(file_path)[1]
+        directory = os.path.dirname(file_path)
+        base_name = os.path.splitext(os.path.basename(file_path))[0]
+        new_name = new_name_pattern.replace("{basename}", base_name).replace("{index}", str(index))
+        new_file_path = os.path.join(directory, new_name + ext)
+        os.rename(file_path, new_file_path)
+        return new_file_path
+    return action
+
+
+def create_change_label_action(label: str):
+    """
+    Return an action function that adds a label as a prefix to the file name.
+    """
+    def action(file_path: str, index: int):
+        directory = os.path.dirname(file_path)
+        base_name = os.path.basename(file_path)
+        new_name = f"{label}_{base_name}"
+        new_file_path = os.path.join(directory, new_name)
+        os.rename(file_path, new_file_path)
+        return new_file_path
+    return action
+
+
+def create_add_metadata_action(metadata_key: str, metadata_value: str):
+    """
+    Return an action function that adds metadata to JPEG images using piexif.
+    Note: This action is only supported for JPEG images.
+    The file type is taken from the record's cached extension and media type
+    when apply_action passes one.
+    """
+    def action(file_path: str, index: int, record: FileRecord = None):
+        if record is not None:
+            ext, media_code = record.ext, record.media_code
+        else:
+            ext = file_extension(file_path)
+            media_code = MEDIA_CODE_BY_EXTENSION.get(ext, OTHER_MEDIA_CODE)
+        if media_code != MEDIA_TYPE_CODES["image"]:
+            raise ActionSkipped("not an image")
+        if ext not in {'.jpg', '.jpeg'}:
+            raise ActionSkipped("metadata editing is supported only for JPEG images")
+        try:
+            import piexif
+        except ImportError:
+            raise ImportError("piexif module not installed. Install it with 'pip install piexif'.")
+        try:
+            exif_dict = piexif.load(file_path)
+        except Exception:
+            exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "1st": {}, "thumbnail": None}
+        from piexif import ImageIFD
+        existing = exif_dict["0th"].get(ImageIFD.ImageDescription, b"").decode("utf-8", errors="ignore")
+        new_description = f"{existing}; {metadata_key}: {metadata_value}" if existing else f"{metadata_key}: {metadata_value}"
+        exif_dict["0th"][ImageIFD.ImageDescription] = new_description.encode("utf-8")
+        exif_bytes = piexif.dump(exif_dict)
+        piexif.insert(exif_bytes, file_path)
+    action.uses_record = True
+    return action
+
+
+def interactive_main():
+    """Prompt-driven session, used when filesorter is run without arguments."""
+    print("Welcome to the File Organizer!")
+    
+    folder = input("Enter the folder path to organize: ").strip()
+    if not os.path.isdir(folder):
+        print_error("Invalid folder path.")
+        return
+
+    journal_path = default_journal_path(folder)
+    if os.path.exists(journal_path):
+        state = MoveJournal.load(journal_path)
+        choice = ""
+        if not state["complete"]:
+            choice = input("A previous reorganization of this folder was interrupted. "
+                           "Resume it (r), undo it (u) or continue (Enter)? ").strip().lower()
+        elif set(state["done"]) - state["undone"]:
+            choice = input("Undo the previous reorganization of this folder (u) or continue (Enter)? ").strip().lower()
+        if choice == "r" and not state["complete"]:
+            FileOrganizer(folder).resume_moves(journal_path)
+            print("Done.")
+            return
+        if choice == "u":
+            restored = undo_moves(journal_path)
+            print_success(f"Restored {restored} file{'s' if restored != 1 else ''}.")
+            return
+
+    organizer = FileOrganizer(folder)
+    print("Scanning files...")
+    organizer.scan_files()
+    print_success(f"Found {len(organizer.files)} file{'s' if len(organizer.files) != 1 else ''}.")
+
+    print("\nChoose sorting criteria:")
+    print("1. Sort by file extension")
+    print("2. Sort by media type")
+    print("3. Sort by resolution (images & videos)")
+    print("4. Find duplicate files")
+    print("5. Sort by capture date")
+    criteria = input("Enter your choice (1/2/3/4/5): ").strip()
+
+    if criteria == "1":
+        organizer.sort_by_extension()
+    elif criteria == "2":
+        organizer.sort_by_media_type()
+    elif criteria == "3":
+        organizer.sort_by_resolution()
+    elif criteria == "4":
+        organizer.sort_by_duplicates()
+    elif criteria == "5":
+        granularity = input("Group by year, month or day? (year/month/day): ").strip().lower() or "month"
+        if granularity not in DATE_GRANULARITIES:
+            print_error("Invalid choice.")
+            return
+        organizer.sort_by_date(granularity)
+    else:
+        print_error("Invalid choice.")
+        return
+
+    print("\nSorted files:")
+    organizer.display_sorted_files()
+    
+    print(f"Moving into the media hierarchy would take: {organizer.estimate_hierarchy_moves()}")
+    move_choice = input("Would you like to move files into a media hierarchy subfolder? (y/n): ").strip().lower()
+    if move_choice == 'y':
+        # The organizer's groups are now the hierarchy groups.
+        organizer.move_files_to_hierarchy(journal_path)
+
+    # Action selection menu
+    print("Available actions:")
+    print("1. Rename files")
+    print("2. Change label (add prefix)")
+    print("3. Add metadata (JPEG images only)")
+    action_choice = input("Enter action choice (1/2/3) or press Enter to skip actions: ").strip()
+    if action_choice not in ["1", "2", "3"]:
+        print("No action selected. Exiting.")
+        return
+
+    group_key = input("Enter the group key to apply the action (as displayed above): ").strip()
+    if action_choice == "1":
+        pattern = input("Enter new name pattern (use {basename} for original name and {index} for sequential number): ").strip()
+        action_fn = create_rename_action(pattern)
+    elif action_choice == "2":
+        label = input("Enter label to add as prefix: ").strip()
+        action_fn = create_change_label_action(label)
+    elif action_choice == "3":
+        metadata_key = input("Enter metadata key: ").strip()
+        metadata_value = input("Enter metadata value: ").strip()
+        action_fn = create_add_metadata_action(metadata_key, metadata_value)
+
+    print("\nApplying action...")
+    organizer.apply_action(group_key, action_fn)
+    print("Done.")
+
+
+# Exit codes of the command-line interface.
+EXIT_OK = 0       # Everything succeeded.
+EXIT_FAILURES = 1  # The command ran, but some files failed.
+EXIT_USAGE = 2    # Bad arguments, folder, group or journal; nothing was changed.
+
+
+def _non_negative_int(text: str) -> int:
+    """argparse type for counts and distances that cannot be negative."""
+    value = int(text)
+    if value < 0:
+        raise argparse.ArgumentTypeError(f"must not be negative: {value}")
+    return value
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Argument parser for the non-interactive command-line interface."""
+    parser = argparse.ArgumentParser(
+        prog="filesorter",
+        description="Organize files by media type, file extension or resolution. "
+                    "Run without arguments for the interactive prompts.")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("folder", help="folder to organize")
+    common.add_argument("--json", action="store_true",
+                        help="print a JSON result on stdout (progress and errors go to stderr)")
+    common.add_argument("--workers", type=int,
+                        help="threads for scanning and for reading file contents (sniffing, hashing, EXIF dates), "
+                             "processes for resolution probing (default: 1 for scanning and probing, "
+                             "8 for reading contents)")
+    common.add_argument("--catalog", metavar="DB", help="SQLite scan catalog for incremental rescans")
+    common.add_argument("--resolution-cache", metavar="DB", help="SQLite resolution cache shared across runs")
+    common.add_argument("--log", metavar="FILE", help="append a line per processed file to FILE")
+    common.add_argument("--verbose", action="store_true", help="print a line per processed file")
+    sorting = argparse.ArgumentParser(add_help=False)
+    sorting.add_argument("--by", choices=list(GROUP_KEY_FUNCTIONS) + ["duplicates", "similar", "date"], default="extension",
+                         help="sorting criteria (default: extension)")
+    sorting.add_argument("--timeout", type=float, default=30.0,
+                         help="with --workers > 1: seconds after which probing a single file's resolution "
+                              "is given up (default: 30)")
+    sorting.add_argument("--distance", type=_non_negative_int, default=8,
+                         help="with --by similar: largest Hamming distance between similar images (default: 8)")
+    sorting.add_argument("--hash", choices=("phash", "dhash"), default="phash",
+                         help="with --by similar: perceptual hash to compare (default: phash)")
+    sorting.add_argument("--date-granularity", choices=list(DATE_GRANULARITIES), default="month",
+                         help="with --by date: group per year, month or day (default: month)")
+    sorting.add_argument("--sniff", action="store_true",
+                         help="identify files by their content when the extension is missing or wrong, "
+                              "and report the files whose content and extension disagree")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("scan", parents=[common], help="list the files in the folder")
+    sort = commands.add_parser("sort", parents=[common, sorting], help="group the files and list the groups")
+    sort.add_argument("--format", choices=DISPLAY_FORMATS, default="text",
+                      help="list every file (text), one JSON record per file (ndjson) "
+                           "or only the group counts and sizes (summary)")
+    sort.add_argument("--spill-dir", metavar="DIR",
+                      help="stream the files into one list file per group in DIR instead of keeping them in "
+                           "memory, for very large trees (--by extension, media_type or resolution)")
+
+    move = commands.add_parser("move", parents=[common],
+                               help="move the files into the media/extension hierarchy")
+    move.add_argument("--mode", choices=PLACEMENT_MODES, default="move",
+                      help="how files are placed in the hierarchy (default: move)")
+    move.add_argument("--target", metavar="DIR",
+                      help="folder to build the hierarchy in (default: FOLDER itself when moving, "
+                           "FOLDER_sorted next to it for the other modes)")
+    move.add_argument("--journal", metavar="FILE",
+                      help="move journal (default: one per folder under ~/.filesorter)")
+    move.add_argument("--dry-run", action="store_true", help="only estimate the cost of the moves")
+    move.add_argument("--resume", action="store_true", help="finish an interrupted move from its journal")
+
+    undo = commands.add_parser("undo", parents=[common], help="revert the last move from its journal")
+    undo.add_argument("--journal", metavar="FILE",
+                      help="move journal (default: one per folder under ~/.filesorter)")
+
+    action = commands.add_parser("action", parents=[common, sorting],
+                                 help="apply an action to every file of a group")
+    action.add_argument("--group", required=True, help="group key, as listed by the sort command")
+    chosen = action.add_mutually_exclusive_group(required=True)
+    chosen.add_argument("--rename", metavar="PATTERN",
+                        help="rename files; {basename} is the original name, {index} a sequential number")
+    chosen.add_argument("--label", help="add LABEL as a prefix to the file names")
+    chosen.add_argument("--metadata", nargs=2, metavar=("KEY", "VALUE"),
+                        help="add EXIF metadata (JPEG images only)")
+    return parser
+
+
+def _workers(args, default: int) -> int:
+    """The --workers value, or default (that of the step at hand) if it was not given."""
+    return default if args.workers is None else args.workers
+
+
+def _sort_organizer(organizer: FileOrganizer, args) -> list:
+    """
+    Group the organizer's files by the criteria selected on the command line.
+    Returns the records whose content contradicts their extension (only checked with --sniff).
+    """
+    mismatches = []
+    if args.sniff:
+        mismatches = organizer.sniff_contents(_workers(args, 8))
+        for record in mismatches:
+            sys.stderr.write(f"{record.path}: content is {record.content_ext}, not {record.ext}\n")
+    if args.by == "resolution":
+        organizer.sort_by_resolution(_workers(args, 1), timeout=args.timeout)
+    elif args.by == "duplicates":
+        organizer.sort_by_duplicates(_workers(args, 8))
+    elif args.by == "similar":
+        organizer.sort_by_similarity(args.distance, args.hash, _workers(args, 8))
+    elif args.by == "date":
+        organizer.sort_by_date(args.date_granularity, _workers(args, 8))
+    elif args.by == "media_type":
+        organizer.sort_by_media_type(args.sniff)
+    else:
+        organizer.sort_by_extension(args.sniff)
+    return mismatches
+
+
+def _usage_error(args, message: str, out=None) -> int:
+    """
+    Report an error that stopped a command before it changed anything: on
+    stderr, and with --json also as an {"error": message} object on out
+    (default: stdout). Returns EXIT_USAGE.
+    """
+    print_error(message, sys.stderr)
+    if args.json:
+        out = out or sys.stdout
+        json.dump({"error": message}, out)
+        out.write("\n")
+    return EXIT_USAGE
+
+
+def _run_command(args, out, reporter_stream) -> int:
+    """Carry out one parsed command-line command and return its exit code."""
+    def reporter(total_files=None, total_bytes=None):
+        return ProgressReporter(total_files, total_bytes, log_path=args.log, verbose=args.verbose,
+                                stream=reporter_stream)
+
+    def emit(result: dict, text: str = None):
+        if args.json:
+            # ASCII escapes keep paths that are not valid UTF-8 (surrogate escapes) writable to any stdout.
+            json.dump(result, out, indent=2, default=list)  # Path sequences as arrays.
+            out.write("\n")
+        elif text is not None:
+            out.write(text + "\n")
+
+    journal_path = None
+    if args.command in ("move", "undo"):
+        journal_path = args.journal or default_journal_path(args.folder)
+    if args.command == "undo":
+        if not os.path.exists(journal_path):
+            return _usage_error(args, f"No move journal found at {journal_path}.", out)
+        with reporter() as progress:
+            restored = undo_moves(journal_path, reporter=progress)
+        emit({"journal": journal_path, "restored": restored, "failed": progress.errors},
+             f"Restored {restored} file{'s' if restored != 1 else ''}.")
+        return EXIT_FAILURES if progress.errors else EXIT_OK
+
+    catalog = ScanCatalog(args.catalog) if args.catalog else None
+    resolution_cache = ResolutionCache(args.resolution_cache) if args.resolution_cache else None
+    try:
+        organizer = FileOrganizer(args.folder, catalog, resolution_cache)
+        if args.command == "move" and args.resume:
+            if not os.path.exists(journal_path) or MoveJournal.load(journal_path)["complete"]:
+                return _usage_error(args, f"No interrupted move to resume in {journal_path}.", out)
+            with reporter() as progress:
+                new_locations = organizer.resume_moves(journal_path, progress)
+            emit({"journal": journal_path, "moved": sum(map(len, new_locations.values())),
+                  "failed": progress.errors, "groups": new_locations})
+            return EXIT_FAILURES if progress.errors else EXIT_OK
+
+        if args.command == "sort" and args.spill_dir:
+            if args.by not in GROUP_KEY_FUNCTIONS or args.sniff or args.format == "ndjson":
+                return _usage_error(args, "--spill-dir only works with --by extension, media_type or resolution, "
+                                          "and without --sniff or --format ndjson.", out)
+            groups = organizer.stream_groups(args.by, args.spill_dir, _workers(args, 1))
+            emit({"root": args.folder, "criteria": args.by, "spill_dir": args.spill_dir,
+                  "groups": {key: {"files": count, "list": path} for key, (count, path) in groups.items()}},
+                 "\n".join(f"Group: {key} ({count} file{'s' if count != 1 else ''}) -> {path}"
+                           for key, (count, path) in groups.items()))
+            return EXIT_OK
+
+        organizer.scan_files(_workers(args, 1))
+        if args.command == "scan":
+            emit({"root": args.folder, "files": [
+                {"path": record.path, "size": record.size, "mtime": record.mtime, "media_type": record.media_type}
+                for record in organizer.entries]},
+                "\n".join(organizer.files))
+            return EXIT_OK
+
+        if args.command == "sort":
+            mismatches = _sort_organizer(organizer, args)
+            result = {"root": args.folder, "criteria": args.by}
+            if args.sniff:
+                result["mismatches"] = [{"path": record.path, "ext": record.ext, "content": record.content_ext}
+                                        for record in mismatches]
+            if args.json and args.format == "summary":
+                emit(dict(result, groups=organizer.group_summary()))
+            elif args.json and args.format == "text":
+                emit(dict(result, groups=organizer.sorted_files))
+            else:
+                organizer.display_sorted_files(args.format, out)
+            return EXIT_OK
+
+        if args.command == "move":
+            if args.dry_run:
+                estimate = organizer.estimate_hierarchy_moves(args.mode, args.target)
+                emit({"mode": args.mode, "files": len(estimate.plan), "unchanged": estimate.unchanged,
+                      "renames": estimate.renames, "copies": estimate.copies,
+                      "copy_bytes": estimate.copy_bytes, "estimated_seconds": estimate.estimated_seconds},
+                     str(estimate))
+                return EXIT_OK
+            if os.path.exists(journal_path) and not MoveJournal.load(journal_path)["complete"]:
+                return _usage_error(args, f"An interrupted move is journaled in {journal_path}; "
+                                          "use --resume to finish it or undo to revert it.", out)
+            with reporter() as progress:
+                new_locations = organizer.move_files_to_hierarchy(journal_path, args.mode, progress, args.target)
+            emit({"mode": args.mode, "journal": journal_path, "moved": sum(map(len, new_locations.values())),
+                  "failed": progress.errors, "groups": new_locations})
+            return EXIT_FAILURES if progress.errors else EXIT_OK
+
+        # args.command == "action"
+        _sort_organizer(organizer, args)
+        if args.group not in organizer.groups:
+            return _usage_error(args, f"Group '{args.group}' not found.", out)
+        if args.rename is not None:
+            action_fn = create_rename_action(args.rename)
+        elif args.label is not None:
+            action_fn = create_change_label_action(args.label)
+        else:
+            action_fn = create_add_metadata_action(*args.metadata)
+        with reporter(len(organizer.groups[args.group])) as progress:
+            organizer.apply_action(args.group, action_fn, progress)
+        emit({"group": args.group, "applied": progress.files, "skipped": progress.skipped,
+              "failed": progress.errors,
+              "files": organizer.sorted_files.get(args.group, [])})
+        return EXIT_FAILURES if progress.errors else EXIT_OK
+    finally:
+        if resolution_cache is not None:
+            resolution_cache.close()
+        if catalog is not None:
+            catalog.close()
+
+
+def main(argv: list = None) -> int:
+    """
+    Entry point. Without arguments the interactive prompts are used; otherwise
+    the command line is parsed (see build_parser) and one of the EXIT_* codes
+    is returned.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        interactive_main()
+        return EXIT_OK
+    args = build_parser().parse_args(argv)
+    if not os.path.isdir(args.folder):
+        return _usage_error(args, f"Invalid folder path: {args.folder}")
+    try:
+        return _run_command(args, sys.stdout, sys.stderr if args.json else sys.stdout)
+    except ImportError as e:
+        return _usage_error(args, f"Missing optional dependency: {e}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+Reading the EXIF capture time without decoding images: the TIFF structure,
+its JPEG wrapper and the Exif item of HEIF files (found through iinf and iloc).
+"""
+import struct
+
+import pytest
+
+import filesorter
+
+CAPTURED = "2024:07:14 10:20:30"
+
+
+def tiff(datetime: str = CAPTURED, tag: int = 0x9003) -> bytes:
+    """A little-endian TIFF structure whose Exif IFD holds one date and time tag."""
+    ifd0 = struct.pack('<H', 1) + struct.pack('<HHII', 0x8769, 4, 1, 26) + b'\0\0\0\0'
+    exif = struct.pack('<H', 1) + struct.pack('<HHII', tag, 2, 20, 44) + b'\0\0\0\0'
+    return b'II*\x00' + struct.pack('<I', 8) + ifd0 + exif + datetime.encode('ascii') + b'\0'
+
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I', 8 + len(payload)) + box_type + payload
+
+
+def full_box(box_type: bytes, version: int, payload: bytes) -> bytes:
+    return box(box_type, bytes([version, 0, 0, 0]) + payload)
+
+
+def infe(item_id: int, item_type: bytes) -> bytes:
+    return full_box(b'infe', 2, struct.pack('>HH4s', item_id, 0, item_type) + b'\0')
+
+
+def iloc(version: int, items: list, base_offset: int = 0, construction_method: int = 0) -> bytes:
+    """An iloc box with 4-byte offsets and lengths; items are (item_id, [(offset, length), ...])."""
+    base_offset_size = 4 if base_offset else 0
+    id_format = '>I' if version == 2 else '>H'  # Version 2 has 32-bit item counts and IDs.
+    payload = bytes([0x44, base_offset_size << 4]) + struct.pack(id_format, len(items))
+    for item_id, extents in items:
+        payload += struct.pack(id_format, item_id)
+        if version in (1, 2):
+            payload += struct.pack('>H', construction_method)
+        payload += struct.pack('>H', 0)  # data_reference_index
+        if base_offset_size:
+            payload += struct.pack('>I', base_offset)
+        payload += struct.pack('>H', len(extents))
+        for offset, length in extents:
+            payload += struct.pack('>II', offset - base_offset, length)
+    return full_box(b'iloc', version, payload)
+
+
+def heif(iloc_version: int = 0, padding: int = 0, base_offset: bool = False, construction_method: int = 0,
+         split: bool = False, exif_type: bytes = b'Exif') -> bytes:
+    """
+    A HEIC file: ftyp, a meta box listing an image item and an Exif item, then
+    mdat with padding bytes followed by the Exif item (a 4-byte TIFF header offset and the TIFF).
+    """
+    exif_item = b'\0\0\0\0' + tiff()
+    ftyp = box(b'ftyp', b'heic\0\0\0\0mif1heic')
+
+    def build(mdat_start: int) -> bytes:
+        exif_offset = mdat_start + 8 + padding
+        if split:
+            extents = [(exif_offset, 10), (exif_offset + 10, len(exif_item) - 10)]
+        else:
+            extents = [(exif_offset, len(exif_item))]
+        items = [(1, [(mdat_start + 8, 4)]), (2, extents)]
+        iinf = full_box(b'iinf', 0, struct.pack('>H', 2) + infe(1, b'hvc1') + infe(2, exif_type))
+        location = iloc(iloc_version, items, exif_offset if base_offset else 0, construction_method)
+        return ftyp + full_box(b'meta', 0, full_box(b'hdlr', 0, b'\0' * 4 + b'pict' + b'\0' * 13) + iinf + location)
+
+    # The meta box's size does not depend on the offsets it holds, so build it twice.
+    head = build(len(build(0)))
+    return head + box(b'mdat', b'\0' * padding + exif_item)
+
+
+@pytest.mark.parametrize("iloc_version", [0, 1, 2])
+def test_heif_exif_extent(iloc_version):
+    data = heif(iloc_version)
+    offset, length = filesorter._heif_exif_extent(data)
+    assert data[offset:offset + length] == b'\0\0\0\0' + tiff()
+
+
+def test_heif_exif_extent_with_base_offset():
+    data = heif(1, base_offset=True)
+    offset, length = filesorter._heif_exif_extent(data)
+    assert data[offset:offset + length] == b'\0\0\0\0' + tiff()
+
+
+@pytest.mark.parametrize("options", [{"exif_type": b'mime'}, {"iloc_version": 1, "construction_method": 1},
+                                     {"split": True}], ids=["no_exif_item", "idat", "two_extents"])
+def test_heif_exif_extent_unsupported(options):
+    assert filesorter._heif_exif_extent(heif(**options)) is None
+
+
+def test_heif_exif_extent_truncated_iloc(tmp_path):
+    # The Exif item is missing from an iloc box that claims more items than it holds.
+    data = heif().replace(infe(2, b'Exif'), infe(7, b'Exif'))
+    position = data.index(b'iloc') + 10  # Past the box type, version, flags and field sizes.
+    data = data[:position] + struct.pack('>H', 9) + data[position + 2:]
+    with pytest.raises(ValueError):
+        filesorter._heif_exif_extent(data)
+    path = tmp_path / "truncated.heic"
+    path.write_bytes(data)
+    assert filesorter.read_exif_datetime(str(path)) == ""
+
+
+@pytest.mark.parametrize("padding", [0, 100_000], ids=["in_header", "past_header"])
+def test_read_exif_datetime_heic(tmp_path, padding):
+    path = tmp_path / "photo.heic"
+    path.write_bytes(heif(padding=padding))
+    assert filesorter.read_exif_datetime(str(path)) == CAPTURED
+
+
+def test_read_exif_datetime_jpeg_and_tiff(tmp_path):
+    jpeg = b'\xff\xd8' + b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\0' + b'\0' * 9
+    exif = b'Exif\0\0' + tiff()
+    jpeg += b'\xff\xe1' + struct.pack('>H', 2 + len(exif)) + exif + b'\xff\xd9'
+    (tmp_path / "a.jpg").write_bytes(jpeg)
+    (tmp_path / "b.tif").write_bytes(tiff(tag=0x9004))
+    (tmp_path / "c.tif").write_bytes(tiff("0000:00:00 00:00:00"))
+    assert filesorter.read_exif_datetime(str(tmp_path / "a.jpg")) == CAPTURED
+    assert filesorter.read_exif_datetime(str(tmp_path / "b.tif")) == CAPTURED
+    assert filesorter.read_exif_datetime(str(tmp_path / "c.tif")) == ""
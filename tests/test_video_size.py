@@ -0,0 +1,214 @@
+"""
+Container probes of MPEG transport streams (TS and M2TS) and H.264 sequence
+parameter sets, on streams built byte by byte.
+"""
+import io
+import struct
+
+import pytest
+
+import filesorter
+
+
+class BitWriter:
+    """Writes the bits and Exp-Golomb codes of an H.264 RBSP."""
+
+    def __init__(self):
+        self.bits = []
+
+    def u(self, count: int, value: int):
+        self.bits.extend((value >> shift) & 1 for shift in range(count - 1, -1, -1))
+
+    def ue(self, value: int):
+        length = (value + 1).bit_length()
+        self.u(length - 1, 0)
+        self.u(length, value + 1)
+
+    def se(self, value: int):
+        self.ue(2 * value - 1 if value > 0 else -2 * value)
+
+    def rbsp(self) -> bytes:
+        bits = self.bits + [1]  # rbsp_stop_one_bit, then zero padding.
+        bits += [0] * (-len(bits) % 8)
+        return bytes(int("".join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8))
+
+
+def escape(rbsp: bytes) -> bytes:
+    """Insert the emulation prevention bytes of an H.264 NAL unit payload."""
+    out = bytearray()
+    zeros = 0
+    for byte in rbsp:
+        if zeros >= 2 and byte <= 3:
+            out.append(3)
+            zeros = 0
+        out.append(byte)
+        zeros = zeros + 1 if byte == 0 else 0
+    return bytes(out)
+
+
+def sps_nal(width_mbs: int, height_map_units: int, profile_idc: int = 66, level_idc: int = 30,
+            sps_id: int = 0, frame_mbs_only: int = 1, crop=None, scaling_matrix: bool = False) -> bytes:
+    """A sequence parameter set NAL unit (header byte 0x67) for a 4:2:0 stream."""
+    w = BitWriter()
+    w.u(8, profile_idc)
+    w.u(8, 0)  # Constraint flags.
+    w.u(8, level_idc)
+    w.ue(sps_id)
+    if profile_idc == 100:
+        w.ue(1)  # chroma_format_idc 4:2:0
+        w.ue(0)  # bit_depth_luma_minus8
+        w.ue(0)  # bit_depth_chroma_minus8
+        w.u(1, 0)
+        w.u(1, int(scaling_matrix))
+        if scaling_matrix:
+            w.u(1, 1)  # The first list is present...
+            w.se(-8)   # ...and its first delta makes next_scale 0, ending it.
+            w.u(7, 0)  # The other seven lists are absent.
+    w.ue(0)  # log2_max_frame_num_minus4
+    w.ue(0)  # pic_order_cnt_type
+    w.ue(0)  # log2_max_pic_order_cnt_lsb_minus4
+    w.ue(1)  # max_num_ref_frames
+    w.u(1, 0)
+    w.ue(width_mbs - 1)
+    w.ue(height_map_units - 1)
+    w.u(1, frame_mbs_only)
+    if not frame_mbs_only:
+        w.u(1, 0)  # mb_adaptive_frame_field_flag
+    w.u(1, 1)  # direct_8x8_inference_flag
+    w.u(1, crop is not None)
+    if crop is not None:
+        for value in crop:
+            w.ue(value)
+    w.u(1, 0)  # vui_parameters_present_flag
+    return b'\x67' + escape(w.rbsp())
+
+
+def test_h264_sps_size_uncropped():
+    assert filesorter._h264_sps_size(sps_nal(40, 30)) == (640, 480)
+
+
+def test_h264_sps_size_applies_cropping():
+    # 1920x1088 coded, cropped by 4 chroma rows (8 luma rows) at the bottom.
+    nal = sps_nal(120, 68, profile_idc=100, level_idc=40, crop=(0, 0, 0, 4))
+    assert filesorter._h264_sps_size(nal) == (1920, 1080)
+
+
+def test_h264_sps_size_interlaced_cropping():
+    # Field coding: map units are pairs of macroblock rows, and crop units double.
+    nal = sps_nal(120, 34, frame_mbs_only=0, crop=(0, 0, 0, 2))
+    assert filesorter._h264_sps_size(nal) == (1920, 1080)
+
+
+def test_h264_sps_size_skips_scaling_lists():
+    nal = sps_nal(80, 45, profile_idc=100, scaling_matrix=True)
+    assert filesorter._h264_sps_size(nal) == (1280, 720)
+
+
+def test_h264_sps_size_removes_emulation_prevention_bytes():
+    # Constraint flags and level 0 followed by the long code of sps_id 63 give 00 00 02.
+    nal = sps_nal(40, 30, level_idc=0, sps_id=63)
+    assert b'\x00\x00\x03' in nal
+    assert filesorter._h264_sps_size(nal) == (640, 480)
+
+
+PMT_PID = 0x100
+VIDEO_PID = 0x101
+AUDIO_PID = 0x102
+
+
+def section(table_id: int, body: bytes) -> bytes:
+    """A PSI section with a (dummy) CRC; body starts after section_length."""
+    length = len(body) + 4
+    return bytes([table_id, 0xB0 | (length >> 8), length & 0xFF]) + body + b'\0\0\0\0'
+
+
+def pat(pmt_pid: int = PMT_PID) -> bytes:
+    programs = struct.pack('>HH', 0, 0xE000 | 0x10)  # Network information table, skipped.
+    programs += struct.pack('>HH', 1, 0xE000 | pmt_pid)
+    return section(0x00, struct.pack('>HBBB', 1, 0xC1, 0, 0) + programs)
+
+
+def pmt(streams: list) -> bytes:
+    entries = b''.join(struct.pack('>BHH', stream_type, 0xE000 | pid, 0xF000) for stream_type, pid in streams)
+    return section(0x02, struct.pack('>HBBBHH', 1, 0xC1, 0, 0, 0xE000 | VIDEO_PID, 0xF000) + entries)
+
+
+def packets(pid: int, payload: bytes, adaptation: bytes = None) -> list:
+    """Split payload into 188-byte transport packets of pid, padded with 0xFF."""
+    result = []
+    first = True
+    while payload or first:
+        header = struct.pack('>BH', 0x47, (0x4000 if first else 0) | pid)
+        if first and adaptation is not None:
+            header += bytes([0x30]) + bytes([len(adaptation)]) + adaptation
+        else:
+            header += bytes([0x10])
+        room = 188 - len(header)
+        chunk, payload = payload[:room], payload[room:]
+        result.append(header + chunk + b'\xff' * (room - len(chunk)))
+        first = False
+    return result
+
+
+def pes(elementary_stream: bytes, stream_id: int = 0xE0) -> bytes:
+    return b'\x00\x00\x01' + bytes([stream_id]) + b'\x00\x00\x80\x00\x00' + elementary_stream
+
+
+def transport_stream(streams: list, elementary: dict, m2ts: bool = False, adaptation: bytes = None) -> bytes:
+    data = packets(0, b'\x00' + pat()) + packets(PMT_PID, b'\x00' + pmt(streams))
+    for pid, payload in elementary.items():
+        data += packets(pid, pes(payload), adaptation)
+    if m2ts:
+        return b''.join(struct.pack('>I', index * 1000) + packet for index, packet in enumerate(data))
+    return b''.join(data)
+
+
+H264_1080P = b'\x00\x00\x00\x01' + sps_nal(120, 68, profile_idc=100, crop=(0, 0, 0, 4)) + b'\x00\x00\x00\x01\x68\xce'
+MPEG2_SEQUENCE_HEADER = b'\x00\x00\x01\xb3' + bytes([720 >> 4, ((720 & 0xF) << 4) | (576 >> 8), 576 & 0xFF]) + b'\x13'
+
+
+def probe(data: bytes):
+    return filesorter._mpeg_stream_video_size(io.BytesIO(data), data[:filesorter.VIDEO_HEADER_BYTES])
+
+
+@pytest.mark.parametrize("m2ts", [False, True], ids=["ts", "m2ts"])
+def test_transport_stream_h264(m2ts):
+    data = transport_stream([(0x1B, VIDEO_PID)], {VIDEO_PID: H264_1080P}, m2ts=m2ts)
+    assert len(data) % (192 if m2ts else 188) == 0
+    assert probe(data) == (1920, 1080)
+
+
+def test_transport_stream_mpeg2():
+    assert probe(transport_stream([(0x02, VIDEO_PID)], {VIDEO_PID: MPEG2_SEQUENCE_HEADER})) == (720, 576)
+
+
+def test_transport_stream_with_adaptation_field():
+    data = transport_stream([(0x1B, VIDEO_PID)], {VIDEO_PID: H264_1080P}, adaptation=b'\x50' + b'\0' * 6)
+    assert probe(data) == (1920, 1080)
+
+
+def test_transport_stream_ignores_undeclared_streams():
+    # The audio PID carries bytes that look like a sequence header; only the PMT's video PID counts.
+    data = transport_stream([(0x0F, AUDIO_PID), (0x1B, VIDEO_PID)],
+                            {AUDIO_PID: MPEG2_SEQUENCE_HEADER, VIDEO_PID: H264_1080P})
+    assert probe(data) == (1920, 1080)
+    assert probe(transport_stream([(0x0F, AUDIO_PID)], {AUDIO_PID: MPEG2_SEQUENCE_HEADER})) is None
+
+
+def test_ts_video_streams_reads_pat_and_pmt():
+    payloads = {0: [b'\x00' + pat()], PMT_PID: [b'\x00' + pmt([(0x0F, AUDIO_PID), (0x1B, VIDEO_PID),
+                                                              (0x02, 0x103)])]}
+    assert filesorter._ts_video_streams(payloads) == {VIDEO_PID: "h264", 0x103: "mpeg"}
+    assert filesorter._ts_video_streams({}) == {}
+
+
+def test_program_stream():
+    data = b'\x00\x00\x01\xba' + b'\x44' + b'\0' * 9 + MPEG2_SEQUENCE_HEADER
+    assert probe(data) == (720, 576)
+
+
+@pytest.mark.parametrize("m2ts", [False, True], ids=["ts", "m2ts"])
+def test_read_video_size_dispatches_transport_streams(tmp_path, m2ts):
+    path = tmp_path / ("clip.m2ts" if m2ts else "clip.ts")
+    path.write_bytes(transport_stream([(0x1B, VIDEO_PID)], {VIDEO_PID: H264_1080P}, m2ts=m2ts))
+    assert filesorter.read_video_size(str(path)) == (1920, 1080)